@@ -2,39 +2,10 @@
 # Math
 import glm
 # Settings
-from settings import GRAVITY, TICKS_PER_SECOND
+from settings import GRAVITY
 
 from mesh import DebugMesh
 
-class CollisionData:
-    def __init__(self, colliding : bool, axialOverlap1 : glm.vec3, axialOverlap2 : glm.vec3):
-        self.colliding = colliding
-        self.overlap1 = axialOverlap1
-        self.overlap2 = axialOverlap2
-
-        self.correctionVector = glm.vec3(0.0)
-        self.collisionAxis = None
-        self.CalculateCorrectionVector()
-
-    def CalculateCorrectionVector(self):
-        absOverlaps1 = [abs(o) for o in self.overlap1]
-        absOverlaps2 = [abs(o) for o in self.overlap2]
-
-        minOverlap1 = min(absOverlaps1)
-        minOverlap2 = min(absOverlaps2)
-
-        overallMin = min([minOverlap1, minOverlap2])
-
-        o1min = overallMin == minOverlap1
-
-        overlapIndex = absOverlaps1.index(overallMin) if o1min else absOverlaps2.index(overallMin)
-        self.collisionAxis = overlapIndex
-
-        collisionDelta = 0.001
-
-        correctionAmount = self.overlap1[overlapIndex] + collisionDelta if o1min else -(self.overlap2[overlapIndex] + collisionDelta)
-        self.correctionVector[overlapIndex] = correctionAmount
-        
 class AABB:
     def __init__(self, center, dimensions = glm.vec3(1.0), debugBoxColor = None, positionCentered = True):
         self.dimensions = glm.vec3(dimensions)
@@ -43,6 +14,7 @@ class AABB:
             self.position = glm.vec3(center) - self.dimensions / 2
         else:
             self.position = glm.vec3(center)
+        self.previousPosition = glm.vec3(self.position) # Position at the last tick, for interpolating
 
         if debugBoxColor is not None:
             self.SetupDebugBox(debugBoxColor)
@@ -92,47 +64,20 @@ class AABB:
     def addToPosition(self, offset):
         self.position += offset
 
-    def GetCollisionData(self, box):
-        ox1 = box.dimensions.x - self.position.x + box.position.x
-        oy1 = box.dimensions.y - self.position.y + box.position.y
-        oz1 = box.dimensions.z - self.position.z + box.position.z
-
-        ox2 = self.dimensions.x - box.position.x + self.position.x
-        oy2 = self.dimensions.y - box.position.y + self.position.y
-        oz2 = self.dimensions.z - box.position.z + self.position.z
-
-        colliding = ox1 > 0 and oy1 > 0 and oz1 > 0 and ox2 > 0 and oy2 > 0 and oz2 > 0
-
-        return CollisionData(colliding, glm.vec3(ox1, oy1, oz1), glm.vec3(ox2, oy2, oz2))
+    # Keep the position from before a tick so that rendering can interpolate between the two
+    def storePreviousPosition(self):
+        self.previousPosition = glm.vec3(self.position)
 
-    def update(self, dt):
-        # TODO: Fix this so that it processes physics anyway (should resolve with Mesh.addData() being fixed)
-        if dt < 1 / TICKS_PER_SECOND and self.active:
-            # Accelerate velocity for gravity
-            self.velocity += self.acceleration * dt
+    # Get the position part of the way (alpha, 0 to 1) from the last tick's position to the current one
+    def getInterpolatedPosition(self, alpha):
+        return glm.mix(self.previousPosition, self.position, alpha)
 
-            # Add velocity to position
-            self.position += self.velocity * dt
-
-            self.reloadDebugModelMatrix()
-
-    def reloadDebugModelMatrix(self):
+    def reloadDebugModelMatrix(self, alpha = 1.0):
         try:
-            self.debugBoxModelMat = glm.translate(glm.mat4(1.0), self.position)
+            self.debugBoxModelMat = glm.translate(glm.mat4(1.0), self.getInterpolatedPosition(alpha))
         except AttributeError:
             pass
             
-    def collideWithActive(self, box):
-        """
-        For collisions with other moving objects like entities that will react to the collision as well.
-        """
-        collisionData = self.GetCollisionData(box)
-
-    def collideWithPassive(self, box):
-        """
-        For collisions with stationary objects like blocks that will NOT react to the collision.
-        i.e. only this AABB will collide and react.
-        """
     def DrawDebug(self, shader):
         try:
             shader.use()
@@ -0,0 +1,237 @@
+# Imports
+# Default
+import bisect
+from ctypes import sizeof, c_void_p
+# Other
+from OpenGL.GL import *
+import numpy as np
+# Project Files
+from mesh import *
+from profiling import *
+from telemetry import frameCounters
+
+from settings import UINTS_PER_PACKED_VERTEX, CHUNK_ARENA_PAGE_VERTICES, CHUNK_ARENA_INITIAL_PAGES
+
+# Chunk arena
+# Every chunk's packed vertices live in one vertex buffer, so all of the visible chunks are drawn with a single
+# glMultiDrawElementsBaseVertex call (using the shared quad index buffer with each chunk's first vertex as the base).
+#
+# The buffer is split into pages of CHUNK_ARENA_PAGE_VERTICES vertices and each chunk gets a run of whole pages.
+# Vertex positions are chunk local, so instead of a model matrix per draw the vertex shader looks up the chunk origin
+# of the page that gl_VertexID is in (a page table in a buffer texture, see chunkVertexCode).
+VERTEX_BYTES = UINTS_PER_PACKED_VERTEX * sizeof(GLuint)
+PAGE_BYTES = CHUNK_ARENA_PAGE_VERTICES * VERTEX_BYTES
+ORIGIN_TEXTURE_UNIT = 2 # 0 and 1 are the block atlas and the sun and moon
+
+class ChunkArena:
+    def __init__(self, numPages = CHUNK_ARENA_INITIAL_PAGES):
+        self.numPages = numPages
+        # Free runs of pages as [first page, page count], sorted and never touching each other
+        self.freeRuns = [[0, numPages]]
+        # Chunk origin (x, z in blocks) of each page
+        self.pageOrigins = np.zeros((numPages, 2), dtype=np.int32)
+        # Created on first use, there's no OpenGL context when this module is imported
+        self.VAO = None; self.VBO = None
+        self.originBuffer = None; self.originTexture = None
+
+    def setup(self):
+        if self.VAO is not None:
+            return
+        self.VAO = GLuint(0); self.VBO = GLuint(0); self.originBuffer = GLuint(0)
+        glGenVertexArrays(1, self.VAO)
+        glGenBuffers(1, self.VBO)
+        glBindVertexArray(self.VAO)
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        glBufferData(GL_ARRAY_BUFFER, self.numPages * PAGE_BYTES, None, GL_DYNAMIC_DRAW)
+        self.setupAttributes()
+        quadIndices.reserve(1)
+        quadIndices.bind()
+        glBindVertexArray(0)
+
+        # Page table
+        glGenBuffers(1, self.originBuffer)
+        glBindBuffer(GL_TEXTURE_BUFFER, self.originBuffer)
+        glBufferData(GL_TEXTURE_BUFFER, self.pageOrigins.nbytes, self.pageOrigins, GL_DYNAMIC_DRAW)
+        self.originTexture = glGenTextures(1)
+        glBindTexture(GL_TEXTURE_BUFFER, self.originTexture)
+        glTexBuffer(GL_TEXTURE_BUFFER, GL_RG32I, self.originBuffer)
+        glBindTexture(GL_TEXTURE_BUFFER, 0)
+
+    def setupAttributes(self):
+        # Both words as one integer attribute (decoded by chunkVertexCode)
+        glVertexAttribIPointer(0, 2, GL_UNSIGNED_INT, VERTEX_BYTES, c_void_p(0))
+        glEnableVertexAttribArray(0)
+
+    # Page allocation
+    # Get the first page of a free run of numPages pages (the buffer grows if there isn't one)
+    def allocate(self, numPages):
+        self.setup()
+        for i, (start, count) in enumerate(self.freeRuns):
+            if count >= numPages:
+                if count == numPages:
+                    del self.freeRuns[i]
+                else:
+                    self.freeRuns[i] = [start + numPages, count - numPages]
+                return start
+        self.grow(max(self.numPages * 2, self.numPages + numPages))
+        return self.allocate(numPages)
+
+    # Give pages back, merging them with the free runs next to them
+    def free(self, start, numPages):
+        i = bisect.bisect(self.freeRuns, [start, numPages])
+        self.freeRuns.insert(i, [start, numPages])
+        if i + 1 < len(self.freeRuns) and start + numPages == self.freeRuns[i + 1][0]:
+            self.freeRuns[i][1] += self.freeRuns.pop(i + 1)[1]
+        if i > 0 and self.freeRuns[i - 1][0] + self.freeRuns[i - 1][1] == start:
+            self.freeRuns[i - 1][1] += self.freeRuns.pop(i)[1]
+
+    # Make the buffer hold numPages pages (keeping the data that's in it)
+    @profile("ChunkArena.grow(int)")
+    def grow(self, numPages):
+        oldPages = self.numPages
+        self.numPages = numPages
+        self.free(oldPages, numPages - oldPages)
+        # Vertex buffer (the VAO's attributes have to be pointed at the new one)
+        glBindVertexArray(self.VAO)
+        newVBO = GLuint(0)
+        glGenBuffers(1, newVBO)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, newVBO)
+        glBufferData(GL_COPY_WRITE_BUFFER, numPages * PAGE_BYTES, None, GL_DYNAMIC_DRAW)
+        glBindBuffer(GL_COPY_READ_BUFFER, self.VBO)
+        glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, oldPages * PAGE_BYTES)
+        glDeleteBuffers(1, self.VBO)
+        self.VBO = newVBO
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        self.setupAttributes()
+        glBindVertexArray(0)
+        # Page table
+        self.pageOrigins = np.concatenate([self.pageOrigins, np.zeros((numPages - oldPages, 2), dtype=np.int32)])
+        glBindBuffer(GL_TEXTURE_BUFFER, self.originBuffer)
+        glBufferData(GL_TEXTURE_BUFFER, self.pageOrigins.nbytes, self.pageOrigins, GL_DYNAMIC_DRAW)
+
+    def setPageOrigins(self, start, numPages, origin):
+        self.pageOrigins[start:start + numPages] = origin
+        glBindBuffer(GL_TEXTURE_BUFFER, self.originBuffer)
+        glBufferSubData(GL_TEXTURE_BUFFER, start * self.pageOrigins.itemsize * 2, numPages * self.pageOrigins.itemsize * 2,
+                        self.pageOrigins[start:start + numPages])
+
+    # Copy vertices from one place in the buffer to another (the ranges can't overlap)
+    def copy(self, fromVertex, toVertex, numVertices):
+        glBindBuffer(GL_COPY_READ_BUFFER, self.VBO)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.VBO)
+        glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, fromVertex * VERTEX_BYTES, toVertex * VERTEX_BYTES,
+                            numVertices * VERTEX_BYTES)
+
+    # Memory (including the free pages and the page table)
+    def getAllocatedBytes(self):
+        return self.numPages * PAGE_BYTES + self.pageOrigins.nbytes if self.VAO is not None else 0
+
+    # Draw a list of ArenaMeshes with one draw call, the shader has to be in use
+    @profile("ChunkArena.Draw(ShaderProgram, list)")
+    def Draw(self, shader, meshes):
+        meshes = [mesh for mesh in meshes if mesh.drawLength > 0]
+        if not meshes:
+            return
+        counts = np.fromiter((mesh.drawLength for mesh in meshes), dtype=np.int32, count=len(meshes))
+        baseVertices = np.fromiter((mesh.firstVertex for mesh in meshes), dtype=np.int32, count=len(meshes))
+        offsets = np.zeros(len(meshes), dtype=np.uintp) # Every chunk starts at the beginning of the quad indices
+
+        glActiveTexture(GL_TEXTURE0 + ORIGIN_TEXTURE_UNIT)
+        glBindTexture(GL_TEXTURE_BUFFER, self.originTexture)
+        shader.setInt("uChunkOrigins", ORIGIN_TEXTURE_UNIT)
+        shader.setInt("uArenaPageVertices", CHUNK_ARENA_PAGE_VERTICES)
+        glBindVertexArray(self.VAO)
+        glMultiDrawElementsBaseVertex(GL_TRIANGLES, counts, GL_UNSIGNED_INT, offsets, len(meshes), baseVertices)
+        glActiveTexture(GL_TEXTURE0)
+        frameCounters.drawCalls += 1; frameCounters.glCalls += 5
+        frameCounters.vertices += sum(mesh.EndIndex for mesh in meshes) // UINTS_PER_PACKED_VERTEX
+
+chunkArena = ChunkArena()
+
+# A chunk's mesh in the arena, a run of pages that moves to a bigger (or smaller) run when it needs to
+# Has the same methods for changing the vertices as Mesh, but gets drawn by ChunkArena.Draw()
+class ArenaMesh:
+    valuesPerVertex = UINTS_PER_PACKED_VERTEX
+    valueDtype = np.uint32
+
+    def __init__(self, origin, arena = chunkArena):
+        self.arena = arena
+        self.origin = origin # World space x, z of the chunk's (0, 0) block column
+        self.firstPage = 0; self.numPages = 0
+        self.EndIndex = 0 # In values, not bytes
+        self.drawLength = 0
+
+    @property
+    def capacity(self): # In vertices
+        return self.numPages * CHUNK_ARENA_PAGE_VERTICES
+
+    @property
+    def firstVertex(self):
+        return self.firstPage * CHUNK_ARENA_PAGE_VERTICES
+
+    def getAllocatedBytes(self):
+        return self.numPages * PAGE_BYTES
+
+    def getUsedBytes(self):
+        return self.EndIndex * sizeof(GLuint)
+
+    # Move the mesh to a run of pages with room for a number of vertices
+    @profile("ArenaMesh.resize(int)")
+    def resize(self, capacity):
+        numPages = -(-capacity // CHUNK_ARENA_PAGE_VERTICES)
+        if numPages == self.numPages:
+            return
+        quadIndices.reserve(numPages * CHUNK_ARENA_PAGE_VERTICES // 4)
+        firstPage = self.arena.allocate(numPages) if numPages > 0 else 0
+        usedVertices = self.EndIndex // self.valuesPerVertex
+        if usedVertices > 0:
+            self.arena.copy(self.firstVertex, firstPage * CHUNK_ARENA_PAGE_VERTICES, usedVertices)
+        if self.numPages > 0:
+            self.arena.free(self.firstPage, self.numPages)
+        self.firstPage, self.numPages = firstPage, numPages
+        if numPages > 0:
+            self.arena.setPageOrigins(firstPage, numPages, self.origin)
+
+    # Make room for a number of vertices, at least doubling the capacity so that appending stays cheap
+    def reserve(self, numVertices):
+        if numVertices > self.capacity:
+            self.resize(max(numVertices, self.capacity * 2))
+
+    # Give pages back after large deletions (when less than a quarter of the capacity is used)
+    def shrink(self):
+        usedVertices = self.EndIndex // self.valuesPerVertex
+        if usedVertices * 4 < self.capacity:
+            self.resize(usedVertices * 2)
+
+    # Append vertices to the end of the mesh
+    @profile("ArenaMesh.addData(list)")
+    def addData(self, vertices):
+        if len(vertices) == 0:
+            return
+        self.reserve((self.EndIndex + len(vertices)) // self.valuesPerVertex)
+        self.updateData(self.EndIndex, vertices)
+        self.truncate(self.EndIndex + len(vertices))
+
+    # Overwrite vertices that are already in the mesh, starting at a value offset
+    def updateData(self, offset, vertices):
+        glBindBuffer(GL_ARRAY_BUFFER, self.arena.VBO)
+        glBufferSubData(GL_ARRAY_BUFFER, self.firstVertex * VERTEX_BYTES + offset * sizeof(GLuint),
+                        len(vertices) * sizeof(GLuint), toGLBuffer(vertices, self.valueDtype))
+
+    # Drop everything past a value offset (or move the end forward after appending)
+    def truncate(self, length):
+        self.EndIndex = length
+        self.drawLength = (length // self.valuesPerVertex // 4) * INDICES_PER_FACE
+
+    # Read the used vertex values back from the GPU
+    def readData(self):
+        data = np.empty(self.EndIndex, dtype=self.valueDtype)
+        if self.EndIndex > 0:
+            glBindBuffer(GL_ARRAY_BUFFER, self.arena.VBO)
+            glGetBufferSubData(GL_ARRAY_BUFFER, self.firstVertex * VERTEX_BYTES, data.nbytes, data.view(np.uint8))
+        return data
+
+    # Give the mesh's pages back to the arena (the mesh can't be drawn after this)
+    def delete(self):
+        self.truncate(0)
+        self.resize(0)
@@ -0,0 +1,130 @@
+# Chunk generation benchmark
+# Times terrain generation and meshing for a fixed set of seeds and chunks without a window or an OpenGL context
+#
+#     python benchmark.py                            run with the default seeds and chunks
+#     python benchmark.py --save before.json         keep the results to compare against later
+#     python benchmark.py --compare before.json      compare with saved results (exits with 1 if any mesh changed)
+#     python benchmark.py --greedy / --no-greedy     override GREEDY_MESHING
+
+# Imports
+# Default
+import argparse
+import hashlib
+import json
+import sys
+import time
+import tracemalloc
+# Project Files
+from chunk import *
+
+from settings import GREEDY_MESHING
+
+DEFAULT_SEEDS = [1234, 99, 2021]
+DEFAULT_RADIUS = 1 # Each seed generates the (2 * radius + 1) x (2 * radius + 1) chunks around the origin
+
+# Time one chunk, the terrain and the meshing are timed separately (the fastest of a number of repeats)
+def benchmarkChunk(x, y, seed, greedy, repeats):
+    generateTimes, meshTimes = list(), list()
+    for _ in range(repeats):
+        start = time.perf_counter()
+        chunk = Chunk(x, y, seed, greedy=greedy)
+        generated = time.perf_counter()
+        blocks, vertices, indices = buildChunkMesh(x, y, seed, greedy, chunk.blocks)
+        meshed = time.perf_counter()
+        generateTimes.append(generated - start); meshTimes.append(meshed - generated)
+
+    return {
+        "generateMs": min(generateTimes) * 1000,
+        "meshMs": min(meshTimes) * 1000,
+        "vertices": len(vertices) // UINTS_PER_PACKED_VERTEX,
+        "indices": len(indices),
+        # Changes whenever the blocks or the mesh change
+        "checksum": hashlib.sha1(blocks.tobytes() + vertices.tobytes()).hexdigest(),
+    }
+
+# Get the most memory that building a chunk's mesh from scratch allocates at once (in bytes)
+def measurePeakMemory(x, y, seed, greedy):
+    tracemalloc.start()
+    buildChunkMesh(x, y, seed, greedy)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+def runBenchmark(seeds, radius, greedy, repeats):
+    chunkPositions = [(x, y) for x in range(-radius, radius + 1) for y in range(-radius, radius + 1)]
+    chunks = dict()
+    peakMemory = 0
+    for seed in seeds:
+        getNoiseContext(seed) # Setting up the noise generators only happens once per seed, so it isn't timed
+        for x, y in chunkPositions:
+            chunks["%d:%d:%d" % (seed, x, y)] = benchmarkChunk(x, y, seed, greedy, repeats)
+            print("seed %d chunk (%d, %d): %s" % (seed, x, y, formatChunk(chunks["%d:%d:%d" % (seed, x, y)])))
+        # Tracing memory slows everything down, so it gets its own pass
+        peakMemory = max(peakMemory, measurePeakMemory(*chunkPositions[0], seed, greedy))
+
+    results = list(chunks.values())
+    mean = lambda key: sum(r[key] for r in results) / len(results)
+    summary = {
+        "chunks": len(results),
+        "chunksPerSecond": 1000 / (mean("generateMs") + mean("meshMs")),
+        "generateMs": mean("generateMs"),
+        "meshMs": mean("meshMs"),
+        "verticesPerChunk": mean("vertices"),
+        "peakMemoryMB": peakMemory / (1024 * 1024),
+    }
+    return {"settings": {"seeds": seeds, "radius": radius, "greedy": greedy, "repeats": repeats},
+            "summary": summary, "chunks": chunks}
+
+def formatChunk(result):
+    return "generate %.1fms, mesh %.1fms, %d vertices" % (result["generateMs"], result["meshMs"], result["vertices"])
+
+def printSummary(summary):
+    for key, value in summary.items():
+        print("    %-18s %10.2f" % (key, value))
+
+# Print how the summary changed since the old results and check that every chunk still comes out the same
+# Returns whether all chunks that are in both results match
+def compareResults(old, new):
+    print("%-22s %10s %10s %9s" % ("", "before", "after", "change"))
+    for key, value in new["summary"].items():
+        before = old["summary"].get(key)
+        if before is None:
+            continue
+        change = (value - before) / before * 100 if before else 0.0
+        print("    %-18s %10.2f %10.2f %+8.1f%%" % (key, before, value, change))
+
+    common = old["chunks"].keys() & new["chunks"].keys()
+    changed = sorted(key for key in common if old["chunks"][key]["checksum"] != new["chunks"][key]["checksum"])
+    if old["settings"] != new["settings"]:
+        print("Note: the runs used different settings (%s vs %s)" % (old["settings"], new["settings"]))
+    if changed:
+        print("%d of %d chunks changed: %s" % (len(changed), len(common), ", ".join(changed)))
+    else:
+        print("All %d chunks match" % len(common))
+    return not changed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunk generation and meshing without a window.")
+    parser.add_argument("--seeds", type=int, nargs="+", default=DEFAULT_SEEDS)
+    parser.add_argument("--radius", type=int, default=DEFAULT_RADIUS, help="chunks around the origin for each seed")
+    parser.add_argument("--greedy", action=argparse.BooleanOptionalAction, default=GREEDY_MESHING,
+                        help="use greedy meshing (--no-greedy for the one quad per face baseline)")
+    parser.add_argument("--repeats", type=int, default=1, help="time each chunk this many times and keep the fastest")
+    parser.add_argument("--save", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare with results from an earlier --save")
+    args = parser.parse_args()
+
+    results = runBenchmark(args.seeds, args.radius, args.greedy, args.repeats)
+    print("Summary:")
+    printSummary(results["summary"])
+
+    if args.save:
+        with open(args.save, "w") as file:
+            json.dump(results, file, indent=4)
+    if args.compare:
+        with open(args.compare) as file:
+            if not compareResults(json.load(file), results):
+                sys.exit(1)
+
+if __name__ == "__main__":
+    main()
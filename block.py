@@ -1,4 +1,5 @@
-# A block will store its index and can use it to find where it is in a chunk's vertex buffer data
+# Imports
+import numpy as np
 
 # Get texture coordinates from texture atlas position
 def genTexCoord(x, y, atlasWidth = 4, atlasHeight = 4):
@@ -10,32 +11,43 @@ def genTexCoord(x, y, atlasWidth = 4, atlasHeight = 4):
     coords = [o[0], o[1], o[0] + kX, o[1], o[0] + kX, o[1] + kY, o[0], o[1] + kY]
     return coords
 
-def genTexCoords(blockTop, blockSide, blockBottom, atlasWidth = 4, atlasHeight = 4): # I saw someone else do something similar project and thought it was neat
-    # Get all texcoords
-    top = genTexCoord(*blockTop, atlasWidth, atlasHeight)
-    bottom = genTexCoord(*blockBottom, atlasWidth, atlasHeight)
-    sides = [genTexCoord(*blockSide, atlasWidth, atlasHeight)] * 4 # We have four sides so we do it four times
-    # Add them all together and return
-    return [top, bottom, *sides]
-
 # The amount of textures on the texture atlas for width and height
 AW = 4
 AH = 4
 
+# Block registry
+# Every block type has an integer id (chunks store one per voxel), everything about a type is looked up by its id in the
+# tables below instead of comparing texture coordinates
+AIR = 0 # Id 0 is reserved for empty space
+blockNames = ["air"]
+blockOpacity = [False] # Whether the block hides the faces behind it
+blockFaceTiles = [((0, 0), ) * 6] # The atlas tile of each face (up, down, west, east, north, south)
+
+# Add a block type, the tiles are the positions in a 4x4 grid of the textures for the top, sides and bottom of the block
+# Returns its id (ids are saved in the region files, so new blocks have to be registered after the old ones)
+def registerBlock(name, top, side, bottom, opaque):
+    tiles = (top, bottom, side, side, side, side) # We have four sides so we use it four times
+    blockNames.append(name)
+    blockOpacity.append(opaque)
+    blockFaceTiles.append(tiles)
+    return len(blockNames) - 1
+
 # Block types
-# The tuples are the positions in a 4x4 grid of the textures for top sides and bottom of the block
-GLASS   = genTexCoords((3, 0), (3, 0), (3, 0), AW, AH) # Glass
-WOOD    = genTexCoords((1, 2), (0, 2), (1, 2), AW, AH) # Wood
-PLANKS  = genTexCoords((2, 2), (2, 2), (2, 2), AW, AH) # Planks
-STONE   = genTexCoords((0, 0), (0, 0), (0, 0), AW, AH) # Stone
-SAND    = genTexCoords((1, 0), (1, 0), (1, 0), AW, AH) # Sand
-DIRT    = genTexCoords((0, 1), (0, 1), (0, 1), AW, AH) # Dirt
-GRASS   = genTexCoords((2, 1), (1, 1), (0, 1), AW, AH) # Grass
-WATER   = genTexCoords((2, 0), (2, 0), (2, 0), AW, AH) # Water
-# Usable and opaque blocks
-opaqueBlocks = [WOOD, PLANKS, STONE, SAND, DIRT, GRASS]
+WATER   = registerBlock("water",  (2, 0), (2, 0), (2, 0), False)
+GLASS   = registerBlock("glass",  (3, 0), (3, 0), (3, 0), False)
+WOOD    = registerBlock("wood",   (1, 2), (0, 2), (1, 2), True)
+PLANKS  = registerBlock("planks", (2, 2), (2, 2), (2, 2), True)
+STONE   = registerBlock("stone",  (0, 0), (0, 0), (0, 0), True)
+SAND    = registerBlock("sand",   (1, 0), (1, 0), (1, 0), True)
+DIRT    = registerBlock("dirt",   (0, 1), (0, 1), (0, 1), True)
+GRASS   = registerBlock("grass",  (2, 1), (1, 1), (0, 1), True)
+# Usable blocks
 blockList = [WATER, GLASS, WOOD, PLANKS, STONE, SAND, DIRT, GRASS]
 
+# The same tables as arrays (indexed by block id) for code that works on whole chunks at once
+opacityTable = np.array(blockOpacity, dtype=bool)
+faceTileTable = np.array(blockFaceTiles, dtype=np.uint8) # (block, face, xy)
+
 # Define block face types
 # Up
 blockFaceUp = (0, 1, 1,   1, 1, 1,   1, 1, 0,   0, 1, 0) # The vertices of a face should be defined counter clockwise
@@ -65,6 +77,16 @@ backward = (0, 0,  1)  # the negative z direction is forward
 # Put them in an array
 faceOffsets = [up, down, left, right, forward, backward]
 
+# The directions that texture u and v go along each face (from the vertex order of the faces above)
+faceAxes = [
+    ((1, 0, 0), (0, 0, -1)),
+    ((1, 0, 0), (0, 0, 1)),
+    ((0, 0, 1), (0, 1, 0)),
+    ((0, 0, -1), (0, 1, 0)),
+    ((-1, 0, 0), (0, 1, 0)),
+    ((1, 0, 0), (0, 1, 0))
+]
+
 # Indices of face offsets
 faceNeighbors = [
     [4, 5, 2, 3],
@@ -77,15 +99,3 @@ faceNeighbors = [
 
 def toBlockPos(pos : tuple):
     return tuple([pos[0] // 1, pos[1] // 1, pos[2] // 1])
-
-class Block:
-    def __init__(self, blockIndex : int, atlasLookupCoordinates : list):
-        self.index = blockIndex
-        self.TexCoords = atlasLookupCoordinates
-
-    def getIndex(self):
-        return self.index
-
-    def getTexCoords(self):
-        return self.TexCoords
-
@@ -14,6 +14,17 @@ from settings import FoV
 # World up direction
 WORLDUP = glm.vec3(0, 1, 0) # Positive y is the up direction/
 
+# Test if an axis aligned box is at least partly inside of the frustum planes from Camera.getFrustumPlanes()
+def boxInFrustum(planes, boxMin, boxMax):
+    for plane in planes:
+        # The corner of the box that is furthest along the plane's normal
+        x = boxMax.x if plane.x >= 0 else boxMin.x
+        y = boxMax.y if plane.y >= 0 else boxMin.y
+        z = boxMax.z if plane.z >= 0 else boxMin.z
+        if plane.x * x + plane.y * y + plane.z * z + plane.w < 0:
+            return False
+    return True
+
 # Camera class
 class Camera(object):
     # Maximum and minimum pitch values for camera rotation
@@ -31,9 +42,8 @@ class Camera(object):
     sprint = False; crouch = False
 
     # Constructor
+    @profile("Camera.__init__(vec3, vec3, float, float)")
     def __init__(self, pos=(0, 0, 0), rot=(0, 0, 0), FOV = 70.0):
-        t = Timer("Camera.__init__(vec3, vec3, float, float)")
-
         # Set position and rotation
         self.pos = glm.vec3(pos)
         self.rot = glm.vec3(rot)
@@ -47,9 +57,8 @@ class Camera(object):
         self.pos += deltaVec
 
     # Update camera vectors
+    @profile("Camera.updateVectors()")
     def updateVectors(self):
-        t = Timer("    Camera.updateVectors()")
-
         # Get the front vector
         front = glm.vec3()
         front.x = math.sin(glm.radians(self.rot.y + 180)) * math.cos(glm.radians(self.rot.x))
@@ -62,9 +71,8 @@ class Camera(object):
         self.Up = glm.normalize(glm.cross(self.Right, self.Front))
 
     # Mouse input function
+    @profile("Camera.processMouseMotion(float, float, float)")
     def processMouseMotion(self, dx, dy, sensitivity = 0.25):
-        t = Timer("    Camera.processMouseMotion(float, float, float)")
-
         self.rot.x += dy * sensitivity; self.rot.y -= dx * sensitivity
         if self.rot.x > self.maxY: self.rot.x = self.maxY
         elif self.rot.x < self.minY: self.rot.x = self.minY
@@ -72,8 +80,8 @@ class Camera(object):
         self.updateVectors()
 
     # Keyboard input function
+    @profile("Camera.processKeyInput(int, int, bool)")
     def processKeyInput(self, KEY, MODS, keyPressed = True):
-        t = Timer("    Camera.processKeyInput(int, int, bool)")
         # Set the movement booleans for the update function
         # Cardinal
         if KEY == GLFW_KEY_W: self.forward = keyPressed
@@ -100,24 +108,16 @@ class Camera(object):
     def getProjectionMatrix(self, aspectRatio):
         return glm.perspective(self.FOV, aspectRatio, 0.1, 1000)
 
+    # Get the 6 planes (left, right, bottom, top, near, far) of the view frustum as vec4(a, b, c, d), a point p is on the
+    # inside of a plane when a*p.x + b*p.y + c*p.z + d >= 0
+    def getFrustumPlanes(self, aspectRatio):
+        m = self.getProjectionMatrix(aspectRatio) * self.getViewMatrix()
+        x, y, z, w = (glm.row(m, i) for i in range(4))
+        return [w + x, w - x, w + y, w - y, w + z, w - z]
+
     # Uniform Setting
-    def setUniforms(self, shader, aspectRatio: float):
-        t = Timer("    Camera.setUniforms(ShaderProgram, float)")
-
-        # Use the shader
-        shader.use()
-        # Set the view matrix
-        shader.setMat4("viewMatrix", self.getViewMatrix())
-        # Set the projection matrix
-        shader.setMat4("projectionMatrix", self.getProjectionMatrix(aspectRatio))
-
-    # Set skybox uniforms
-    def setUniformsSkybox(self, shader, aspectRatio: float):
-        t = Timer("    Camera.SetUniformsSkybox(ShaderProgram, float)")
-
-        # Use the shader
-        shader.use()
-        # Set the view matrix
-        shader.setMat4("viewMatrix", self.getViewMatrixRotated())
-        # Set the projection matrix
-        shader.setMat4("projectionMatrix", self.getProjectionMatrix(aspectRatio))
+    # Fill the CameraData block that every shader reads (once per frame, see shader.CameraUniformBuffer)
+    @profile("Camera.setUniformBuffer(CameraUniformBuffer, float, float, float)")
+    def setUniformBuffer(self, buffer, aspectRatio: float, time: float, sunHeight: float):
+        buffer.set(self.getProjectionMatrix(aspectRatio), self.getViewMatrix(), self.getViewMatrixRotated(), self.pos,
+                   time, sunHeight)
@@ -3,11 +3,17 @@
 from terrain_gen import *
 from block import *
 from mesh import *
+from arena import *
 
-from settings import CHUNK_SIZE, CAVE_NOISE_THRESHOLD, AO_CLIPPING_STRENGTH, WATER_LEVEL
-from settings import TICKS_PER_SECOND
+from settings import CHUNK_SIZE, CHUNK_HEIGHT, CAVE_NOISE_THRESHOLD, WATER_LEVEL, GREEDY_MESHING
+from settings import TICKS_PER_SECOND, UINTS_PER_PACKED_VERTEX
+
+import glm
 
 from collections import deque
+from array import array
+
+import numpy as np
 
 # List nesting removal function
 def removeNestings(l):
@@ -17,6 +23,10 @@ def removeNestings(l):
 def addVectors(vec1, vec2):
     return (vec1[0] + vec2[0], vec1[1] + vec2[1], vec1[2] + vec2[2])
 
+# Vector dot product
+def dotVectors(vec1, vec2):
+    return vec1[0] * vec2[0] + vec1[1] * vec2[1] + vec1[2] * vec2[2]
+
 # Translate face data
 def translateFaceData(face: tuple, offset: tuple):
     r = list()
@@ -37,27 +47,110 @@ def isInsideChunk(pos):
 def vertexCountToBytesOffset(numVerts : int):
     return numVerts * 8 * sizeof(GLfloat)
 
+# Offsets of the 8 chunks around a chunk
+neighborOffsets = [(dx, dz) for dx in (-1, 0, 1) for dz in (-1, 0, 1) if dx or dz]
+
+# Offsets of a block and the 26 blocks around it
+neighborhoodOffsets = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+
+VALUES_PER_QUAD = UINTS_PER_PACKED_VERTEX * 4
+
+# The block columns along the sides of a chunk, the only ones whose faces can see into the neighboring chunks
+borderColumns = np.zeros((CHUNK_SIZE, CHUNK_SIZE), dtype=bool)
+borderColumns[[0, -1], :] = True
+borderColumns[:, [0, -1]] = True
+
 def calcVertAO(side1, side2, corner):
     if (side1 and side2):
         return 3
     return side1 + side2 + corner
 
+# calcVertAO() for arrays of sides and corners
+def calcVertAOArray(side1, side2, corner):
+    return np.where(side1 & side2, 3, side1 + side2 + corner)
+
+# The corners of each face as an array (face, corner, xyz) and the texture coordinates of the corners of a one block quad
+faceCornerTable = np.array(blockFaces, dtype=np.uint32).reshape(len(blockFaces), 4, 3)
+quadU = np.array([0, 1, 1, 0], dtype=np.uint32)
+quadV = np.array([0, 0, 1, 1], dtype=np.uint32)
+
+# Pack a quad (chunk local corner positions and ambient occlusion levels) that repeats a texture tile width x height times
+def packQuad(positions, occlusion, tile, width = 1, height = 1):
+    texcoords = ((0, 0), (width, 0), (width, height), (0, height))
+    return removeNestings([packChunkVertex(*positions[i * 3:i * 3 + 3], occlusion[i], *tile, *texcoords[i]) for i in range(4)])
+
+# Pack many one block quads at once (what packQuad() does for each face), x, y, z are chunk local block positions and
+# occlusion is N x 4, returns a flat array of packed vertices
+def packQuads(x, y, z, faces, occlusion, blockIDs):
+    corners = faceCornerTable[faces] + np.stack([x, y, z], axis=1).astype(np.uint32)[:, None, :]
+    tiles = faceTileTable[blockIDs, faces].astype(np.uint32)
+    first = corners[:, :, 0] | (corners[:, :, 1] << 5) | (corners[:, :, 2] << 14) | (occlusion.astype(np.uint32) << 19)
+    second = tiles[:, 0, None] | (tiles[:, 1, None] << 4) | (quadU << 8) | (quadV << 17)
+    return np.stack([first, second], axis=2).ravel()
+
+# Looks up blocks in a fixed set of chunks' block arrays, a stand-in for the World when meshing in the worker processes
+class NeighborBlocks:
+    def __init__(self, chunkBlocks):
+        self.chunkBlocks = chunkBlocks # Chunk position -> blocks
+
+    def getChunkBlocks(self, chunkPos):
+        return self.chunkBlocks.get(chunkPos)
+
+    def getBlockID(self, pos: tuple):
+        blocks = self.chunkBlocks.get((int(pos[0] // CHUNK_SIZE), int(pos[2] // CHUNK_SIZE)))
+        if blocks is None or not 0 <= pos[1] < CHUNK_HEIGHT:
+            return AIR
+        return int(blocks[int(pos[0] % CHUNK_SIZE), int(pos[1]), int(pos[2] % CHUNK_SIZE)])
+
+# Generate a chunk's blocks (unless they're given) and mesh vertices without touching OpenGL (this is what the chunk worker
+# processes run), neighbors has the blocks of the loaded chunks around it by chunk position
+def genChunkData(x, y, seed, greedy = GREEDY_MESHING, blocks = None, neighbors = None):
+    chunk = Chunk(x, y, seed, blocks, greedy)
+    if neighbors:
+        chunk.world = NeighborBlocks(neighbors)
+    return (chunk.blocks, *chunk.genChunkVertices())
+
+# Build a chunk's mesh entirely on the CPU (no OpenGL context needed), returns the chunk's blocks, its packed vertices
+# (uint32, see packChunkVertex) and the indices of its triangles (what the shared index buffer would draw them with)
+def buildChunkMesh(x, y, seed, greedy = GREEDY_MESHING, blocks = None, neighbors = None):
+    blocks, vertices, meshKeys, faceCount = genChunkData(x, y, seed, greedy, blocks, neighbors)
+    vertices = np.asarray(vertices, dtype=np.uint32)
+    return blocks, vertices, genQuadIndices(len(vertices) // VALUES_PER_QUAD)
+
 # Chunk class
 class Chunk:
 
     # Constructor
-    def __init__(self, x, y, seed): # The x and y specify which chunk it is, not the real position of it
-        t = Timer("Chunk.__init__(x, y, seed)")
-
+    # The mesh isn't built here so that chunks can be generated off of the render thread, call generateChunkMesh() or
+    # uploadMesh() on the main thread before drawing
+    @profile("Chunk.__init__(x, y, seed)")
+    def __init__(self, x, y, seed, blocks = None, greedy = GREEDY_MESHING): # The x and y specify which chunk it is, not the real position of it
         # Set chunk position
         self.cPos = (x, y)
+        # World space position of the chunk's (0, 0) block column
+        self.origin = (x * CHUNK_SIZE, y * CHUNK_SIZE)
         # Set seed variable
         self.seed = seed
         # Blocks and mesh variables
-        self.blocks = dict() # Has 3D coordinates for each key and a blockType for each value
-        self.mesh = Mesh()
-        # Setup chunk
-        self.setupblocks()
+        self.blocks = np.zeros((CHUNK_SIZE, CHUNK_HEIGHT, CHUNK_SIZE), dtype=np.uint8) # A block type id for each x, y, z
+        self.mesh = None
+        # Which block face each quad of the mesh belongs to, so that single blocks can be re-meshed
+        self.meshKeys = None # (N, 4) array of x, y, z, face from uploadMesh()
+        self.quadKeys = None # Slot -> (pos, face), built from meshKeys on the first edit
+        self.quadSlots = None # (pos, face) -> slot
+        self.borderStart = None # Slot of the first border column quad, they all come after the others until an edit
+        # Greedy meshing merges faces, so greedy meshes have no meshKeys
+        self.greedy = greedy
+        self.faceCount = 0 # Visible block faces
+        self.quadCount = 0 # Quads in the mesh (less than faceCount when greedy meshing)
+        # Where blocks outside of the chunk are looked up (anything with getBlockID(pos), the World once it's added to one)
+        self.world = None
+        # Setup chunk (unless its blocks were already generated somewhere else)
+        if blocks is None:
+            self.setupblocks()
+        else:
+            self.blocks = blocks
+        self.dirty = blocks is None # Whether the blocks have changes that haven't been saved
         """
         hMap = dict()
         for x in range(CHUNK_SIZE):
@@ -67,6 +160,9 @@ class Chunk:
         self.generateChunkMesh()
         """
 
+        # Bounding box of the chunk's blocks (for culling)
+        self.updateBounds()
+
         # block loading queue
         self.blockQueue = deque()
 
@@ -78,10 +174,11 @@ class Chunk:
             blockArgs = self.blockQueue.popleft()
             self.setBlock(*blockArgs)
 
-    def addBlockToQueue(self, pos, type):
-        self.blockQueue.append((pos, type))
+    def addBlockToQueue(self, pos, blockID):
+        self.blockQueue.append((pos, blockID))
 
     # get lighting of vertices based on neighboring blocks(ambient occlusion)
+    # Returns the occlusion level (0 to 3) of each corner, the shader darkens them by AO_CLIPPING_STRENGTH per level
     def calcAmbientOcclusion(self, pos: tuple, facing: int):
         # Get the position that the face is facing
         openPos = addVectors(pos, faceOffsets[facing])
@@ -97,7 +194,7 @@ class Chunk:
         occlusion = list()
         # We're saving whether the occlusion exists for each side into variables
         # Main 4 sides
-        blockClear = self.blocks[pos].getTexCoords() not in opaqueBlocks
+        blockClear = not blockOpacity[self.getBlockID(pos)]
         _u = self.checkBlockOpacity(addVectors(openPos, faceOffsets[upFace]), blockClear)
         _d = self.checkBlockOpacity(addVectors(openPos, faceOffsets[downFace]), blockClear)
         _l = self.checkBlockOpacity(addVectors(openPos, faceOffsets[leftFace]), blockClear)
@@ -108,130 +205,368 @@ class Chunk:
         _ur = self.checkBlockOpacity(upperRightCorner, blockClear)
         _dr = self.checkBlockOpacity(lowerRightCorner, blockClear)
         # Bottom left corner of the face
-        occlusion.append(1.0 - (calcVertAO(_d, _l, _dl) * AO_CLIPPING_STRENGTH))
+        occlusion.append(calcVertAO(_d, _l, _dl))
         # Bottom right corner
-        occlusion.append(1.0 - (calcVertAO(_r, _d, _dr) * AO_CLIPPING_STRENGTH))
+        occlusion.append(calcVertAO(_r, _d, _dr))
         # Upper right corner
-        occlusion.append(1.0 - (calcVertAO(_u, _r, _ur) * AO_CLIPPING_STRENGTH))
+        occlusion.append(calcVertAO(_u, _r, _ur))
         # Upper Left Corner
-        occlusion.append(1.0 - (calcVertAO(_l, _u, _ul) * AO_CLIPPING_STRENGTH))
+        occlusion.append(calcVertAO(_l, _u, _ul))
         # Return this nightmarish tedious work
         return occlusion
 
     # Setup block data for this chunk
+    @profile("Chunk.setupBlocks()")
     def setupblocks(self):
-        t = Timer("    Chunk.setupBlocks()")
-
         # Generate height map
-        heightMap = dict() # will have a tuple as a key with x, y values and a height value (utilizing python XD)
-        # Loop through the x and z distances
-        for cx in range(CHUNK_SIZE):
-            for cz in range(CHUNK_SIZE): # Technically z because the y axis is the up/height direction
-                # Get block coords
-                _x, _y = cx + (CHUNK_SIZE * self.cPos[0]), cz + (CHUNK_SIZE * self.cPos[1])
-                # The height map is a top down view of the heights on the map
-                biomeVal = getBiomeNoise(_x, _y, self.seed)
-                h = getHeightFromNoise(getFractalNoise(_x, _y, self.seed), biomeVal)
-                heightMap[(cx, cz)] = int(round(h))
+        # The height map is a top down view of the heights on the map, indexed [x, z] in chunk space
+        heightMap = getHeightMap(self.origin[0], self.origin[1], CHUNK_SIZE, self.seed)
         # Fill the block data
         self.fillBlocks(heightMap)
-        # Generate the mesh
-        self.generateChunkMesh()
 
+    @profile("Chunk.fillBlocks(ndarray)")
     def fillBlocks(self, heightMap):
-        t = Timer("    Chunk.fillBlocks(dict)")
-        for pos, height in heightMap.items():
-            for y in range(height + 1):
-                # Get actual block position (since it's in chunk space right now instead of world space)
-                bX = self.cPos[0] * CHUNK_SIZE + pos[0]
-                bZ = self.cPos[1] * CHUNK_SIZE + pos[1]
-                if getCaveNoise(bX, y, bZ, self.seed) > CAVE_NOISE_THRESHOLD:
-                    # Finally, get the block type based on its height
-                    blockType = None
-                    if y == height:
-                        if y < WATER_LEVEL + 2:
-                            blockType = SAND
-                        else:
-                            blockType = GRASS # Grass is only on the top level
-                    elif height > y >= height - 3:
-                        blockType = DIRT # Dirt is only present a couple of blocks below the grass
-                    elif y < height - 3:
-                        blockType = STONE # Stone fills the rest (currently)
-                    self.blocks[(bX, y, bZ)] = Block(len(self.blocks.items()), blockType)
+        # Every block position at or under the height map, in chunk space
+        height = np.minimum(heightMap, CHUNK_HEIGHT - 1)
+        x, y, z = np.nonzero(np.arange(CHUNK_HEIGHT)[None, :, None] <= height[:, None, :])
+        # Carve out the caves (the noise is sampled in world space)
+        solid = getCaveNoiseArray(x + self.origin[0], y, z + self.origin[1], self.seed) > CAVE_NOISE_THRESHOLD
+        x, y, z = x[solid], y[solid], z[solid]
+        # Finally, get the block type based on its height
+        h = heightMap[x, z]
+        surface = np.where(y < WATER_LEVEL + 2, SAND, GRASS) # Grass is only on the top level
+        self.blocks[x, y, z] = np.select([y == h, y >= h - 3], # Dirt is only present a couple of blocks below the grass
+                                         [surface, DIRT],
+                                         STONE) # Stone fills the rest (currently)
+
+    # Convert a world space block position to an index into self.blocks (None if it isn't in this chunk)
+    def toLocalPos(self, pos: tuple):
+        x, y, z = int(pos[0]) - self.origin[0], int(pos[1]), int(pos[2]) - self.origin[1]
+        if 0 <= x < CHUNK_SIZE and 0 <= y < CHUNK_HEIGHT and 0 <= z < CHUNK_SIZE:
+            return x, y, z
+        return None
+
+    # Get the block type id at a world space position (blocks outside of the chunk come from the world, AIR if there isn't
+    # one or that chunk isn't loaded)
+    def getBlockID(self, pos: tuple):
+        localPos = self.toLocalPos(pos)
+        if localPos is None:
+            return AIR if self.world is None else self.world.getBlockID(pos)
+        return int(self.blocks[localPos]) # A python int, numpy bools from comparing it would add up like ORs
 
     # Check block position
     def checkBlock(self, pos: tuple):
-        return pos in self.blocks.keys()
+        return self.getBlockID(pos) != AIR
     # Check block opacity
     def checkBlockOpacity(self, pos: tuple, baseBlockIsClear = False):
         if baseBlockIsClear:
-            try:
-                return pos in self.blocks.keys()
-            except:
-                return False
+            return self.checkBlock(pos)
         else:
-            try:
-                return self.blocks[pos].getTexCoords() in opaqueBlocks
-            except:
-                return False
+            return blockOpacity[self.getBlockID(pos)]
 
     # Check which faces should be visible for a block
     def checkVisibleFaces(self, pos: tuple):
+        blockClear = not blockOpacity[self.getBlockID(pos)]
         # Loop through each neighboring position and check if there is a block
-        return [not self.checkBlockOpacity(addVectors(pos, offset), self.blocks[pos].getTexCoords() not in opaqueBlocks) for offset in faceOffsets]
-
-    def setBlock(self, pos, blockType):
-        if blockType is None:
-            try:
-                del self.blocks[pos]
-            except KeyError:
-                pass
-        else:
-            self.blocks[pos] = Block(len(self.blocks.items()), blockType)
-        # TODO: Change this to update the mesh in only the areas around the block (Mesh.addData())
-        self.reload()
+        return [not self.checkBlockOpacity(addVectors(pos, offset), blockClear) for offset in faceOffsets]
+
+    def setBlock(self, pos, blockID):
+        localPos = self.toLocalPos(pos)
+        if localPos is None:
+            return
+        self.blocks[localPos] = blockID
+        self.dirty = True
+        self.updateBounds()
+        if self.mesh is None:
+            return
+        # Only the faces around the block can change
+        x, y, z = localPos
+        self.updateMeshAround((x + self.origin[0], y, z + self.origin[1]))
+
+    # Fit the bounding box to the lowest and highest layers that have blocks in them
+    def updateBounds(self):
+        layers = np.flatnonzero(self.blocks.any(axis=(0, 2)))
+        bottom, top = (int(layers[0]), int(layers[-1]) + 1) if len(layers) > 0 else (0, 0)
+        self.boundsMin = glm.vec3(self.origin[0], bottom, self.origin[1])
+        self.boundsMax = glm.vec3(self.origin[0] + CHUNK_SIZE, top, self.origin[1] + CHUNK_SIZE)
 
     # Generate chunk mesh (we generate a new one so that we aren't rendering blocks that the player can't see)
     def generateChunkMesh(self):
-        # Loop through blocks and check their surroundings
-        vertices = list()
-        for pos, block in self.blocks.items():
-            # Data variables
-            positions = list()
-            colors = list()
-            texcoords = list()
-            # check neighbors and get visible faces
-            faces = self.checkVisibleFaces(pos)
-            # If any faces are visible, generate the faces and add them to the vertices and texcoords
-            # Get the indices of the visible faces and use them to retrieve faces
-            for i, v in enumerate(faces):
-                if v:
-                    positions = translateFaceData(blockFaces[i], pos) # Add vertices
-                    # Lighting
-                    colors = self.calcAmbientOcclusion(pos, i)
-                    # Add the texcoords of the block
-                    texcoords = block.getTexCoords()[i] # The block data is saved as a set of texture coordinates
-                    verts = [positions[i * 3:i * 3 + 3] + [colors[i],] + texcoords[i * 2:i * 2 + 2] for i in range(len(colors))]
-                    vertices += removeNestings(verts)
-            # Finally, add them to the chunk mesh :)
-            #self.mesh.addData(positions, colors, texcoords)
-            #p += positions; c += colors; t += texcoords
+        self.uploadMesh(*self.genChunkVertices())
+
+    # Create the chunk's mesh from vertex data (OpenGL, so only on the main thread)
+    @profile("Chunk.uploadMesh(array, ndarray, int)")
+    def uploadMesh(self, vertices, meshKeys, faceCount):
+        # Reuse the old pages of the arena when re-meshing (they only grow when they need to)
+        if self.mesh is None:
+            self.mesh = ArenaMesh(self.origin)
+        else:
+            self.mesh.truncate(0)
         self.mesh.addData(vertices)
-        del v
+        self.mesh.shrink()
+        self.meshKeys = meshKeys
+        self.quadKeys = None
+        self.quadSlots = None
+        self.borderStart = self.getBorderStart(meshKeys)
+        self.faceCount = faceCount
+        self.quadCount = len(vertices) // VALUES_PER_QUAD
+
+    # Get the (packed) vertices of one face of a block
+    def genFaceVertices(self, pos: tuple, face: int, blockID: int):
+        localPos = (pos[0] - self.origin[0], pos[1], pos[2] - self.origin[1])
+        positions = translateFaceData(blockFaces[face], localPos) # Add vertices
+        # Lighting
+        occlusion = self.calcAmbientOcclusion(pos, face)
+        # Add the texture of the block
+        tile = blockFaceTiles[blockID][face]
+        return packQuad(positions, occlusion, tile)
+
+    # Get (face, vertices) for every visible face of a block
+    def genBlockQuads(self, pos: tuple):
+        blockID = self.getBlockID(pos)
+        if blockID == AIR:
+            return []
+        # check neighbors and get visible faces
+        return [(i, self.genFaceVertices(pos, i, blockID)) for i, v in enumerate(self.checkVisibleFaces(pos)) if v]
+
+    # Get the vertex data of every visible block face in the chunk, the x, y, z, face that each quad belongs to
+    # (None for greedy meshes) and the number of visible faces
+    @profile("Chunk.genChunkVertices()")
+    def genChunkVertices(self):
+        if self.greedy:
+            return self.genGreedyChunkVertices()
+
+        x, y, z, faces, occlusion = self.findVisibleFaces()
+        vertices = packQuads(x, y, z, faces, occlusion, self.blocks[x, y, z])
+        return vertices, self.getMeshKeys(x, y, z, faces), len(faces)
+
+    # Get the meshKeys of faces from findVisibleFaces()
+    def getMeshKeys(self, x, y, z, faces):
+        return np.stack([x + self.origin[0], y, z + self.origin[1], faces], axis=1).astype(np.int32)
+
+    # Get the slot where the border column quads start in a mesh from genChunkVertices() (None if the quads aren't in that
+    # order, like in greedy meshes and edited meshes that came back from the cache)
+    def getBorderStart(self, meshKeys):
+        if meshKeys is None:
+            return None
+        border = borderColumns[meshKeys[:, 0] - self.origin[0], meshKeys[:, 2] - self.origin[1]]
+        borderStart = len(border) - int(np.count_nonzero(border))
+        return borderStart if border[borderStart:].all() else None
+
+    # Get the chunk's blocks with a one block border of the blocks around it (from the loaded neighbors, AIR elsewhere)
+    def getPaddedBlocks(self):
+        padded = np.zeros((CHUNK_SIZE + 2, CHUNK_HEIGHT + 2, CHUNK_SIZE + 2), dtype=np.uint8)
+        padded[1:-1, 1:-1, 1:-1] = self.blocks
+        if self.world is not None:
+            # Where each neighbor's touching edge comes from and where it goes in the padded array
+            source = {-1: slice(CHUNK_SIZE - 1, CHUNK_SIZE), 0: slice(0, CHUNK_SIZE), 1: slice(0, 1)}
+            destination = {-1: slice(0, 1), 0: slice(1, CHUNK_SIZE + 1), 1: slice(CHUNK_SIZE + 1, CHUNK_SIZE + 2)}
+            for dx, dz in neighborOffsets:
+                blocks = self.world.getChunkBlocks((self.cPos[0] + dx, self.cPos[1] + dz))
+                if blocks is not None:
+                    padded[destination[dx], 1:-1, destination[dz]] = blocks[source[dx], :, source[dz]]
+        return padded
+
+    # Find every visible face in the chunk at once (the same thing checkVisibleFaces() and calcAmbientOcclusion() do for
+    # single blocks), returns the chunk local x, y, z of each face's block, its face index and the occlusion level of its
+    # 4 corners (N x 4), ordered by block and then face, with the faces in the border columns last
+    # columns is an optional (CHUNK_SIZE, CHUNK_SIZE) mask of the block columns to look in
+    @profile("Chunk.findVisibleFaces(ndarray)")
+    def findVisibleFaces(self, columns = None):
+        # Only the layers up to the highest block matter (and one more above them, the padding already has one below)
+        top = int(self.boundsMax.y)
+        # Whether each block of the padded array hides the faces of an opaque block, then the same for a clear block (blocks
+        # that aren't opaque are hidden by any block, opaque blocks only by opaque blocks), flat so that offsets are adds
+        padded = self.getPaddedBlocks()[:, :top + 2, :]
+        hides = np.concatenate([opacityTable[padded].ravel(), (padded != AIR).ravel()])
+        strides = np.array([(top + 2) * (CHUNK_SIZE + 2), CHUNK_SIZE + 2, 1])
+        toOffset = lambda *offsets: int(np.dot(np.sum(offsets, axis=0), strides))
+
+        present = self.blocks[:, :top, :] != AIR
+        if columns is not None:
+            present &= columns[:, None, :]
+        blockX, blockY, blockZ = np.nonzero(present)
+        # Each block's index in hides (in the half for its opacity)
+        blockIndex = ((blockX + 1) * strides[0] + (blockY + 1) * strides[1] + blockZ + 1
+                      + ~opacityTable[self.blocks[blockX, blockY, blockZ]] * padded.size)
+
+        found = list()
+        for face, normal in enumerate(faceOffsets):
+            visible = ~hides[blockIndex + toOffset(normal)]
+            x, y, z, index = blockX[visible], blockY[visible], blockZ[visible], blockIndex[visible]
+            # Whether the blocks at an offset from the faces' blocks occlude them
+            sample = lambda *offsets: hides[index + toOffset(normal, *offsets)].astype(np.uint8)
+            # Same samples as calcAmbientOcclusion()
+            up, down, left, right = (faceOffsets[i] for i in faceNeighbors[face])
+            _u = sample(up); _d = sample(down); _l = sample(left); _r = sample(right)
+            _ul = sample(up, left); _dl = sample(down, left)
+            _ur = sample(up, right); _dr = sample(down, right)
+            occlusion = np.stack([calcVertAOArray(_d, _l, _dl), calcVertAOArray(_r, _d, _dr),
+                                  calcVertAOArray(_u, _r, _ur), calcVertAOArray(_l, _u, _ul)], axis=1)
+            found.append((x, y, z, np.full(len(x), face), occlusion))
+
+        x, y, z, faces, occlusion = (np.concatenate(arrays) for arrays in zip(*found))
+        order = np.lexsort((faces, z, y, x, borderColumns[x, z]))
+        return x[order], y[order], z[order], faces[order], occlusion[order]
+
+    # Same as genChunkVertices(), but faces of the same block type and ambient occlusion that are next to each other on
+    # the same plane get merged into one quad
+    @profile("Chunk.genGreedyChunkVertices()")
+    def genGreedyChunkVertices(self):
+        # Sort the visible faces into planes, each plane maps (u, v) cells to what the face looks like
+        planes = dict()
+        x, y, z, faces, occlusion = self.findVisibleFaces()
+        faceCount = len(faces)
+        for lx, y, lz, face, blockID, occlusion in zip(x.tolist(), y.tolist(), z.tolist(), faces.tolist(),
+                                                       self.blocks[x, y, z].tolist(), map(tuple, occlusion.tolist())):
+            pos = (lx + self.origin[0], y, lz + self.origin[1])
+            # Faces with different ambient occlusion at their corners are shaded with a gradient, so merging them would
+            # change how they look (the position in the key keeps them from matching anything)
+            look = (blockID, occlusion) if occlusion.count(occlusion[0]) == 4 else (blockID, occlusion, pos)
+            uAxis, vAxis = faceAxes[face]
+            plane = (face, dotVectors(pos, faceOffsets[face]))
+            planes.setdefault(plane, dict())[(dotVectors(pos, uAxis), dotVectors(pos, vAxis))] = look
+
+        vertices = array("I")
+        for (face, depth), cells in planes.items():
+            uAxis, vAxis = faceAxes[face]
+            normal = faceOffsets[face]
+            # Get the chunk local block position of a cell in this plane
+            origin = (self.origin[0], 0, self.origin[1])
+            cellPos = lambda u, v: tuple(u * uAxis[i] + v * vAxis[i] + depth * normal[i] - origin[i] for i in range(3))
+            # Go through the cells row by row
+            for u, v in sorted(cells, key=lambda cell: (cell[1], cell[0])):
+                look = cells.get((u, v))
+                if look is None:
+                    continue # Already part of a quad
+                # Grow along u, then along v while whole rows match
+                width = 1
+                while cells.get((u + width, v)) == look:
+                    width += 1
+                height = 1
+                while all(cells.get((u + i, v + height)) == look for i in range(width)):
+                    height += 1
+                for i in range(width):
+                    for j in range(height):
+                        del cells[(u + i, v + j)]
+                # Each corner of the quad comes from the block in that corner
+                corners = [cellPos(u, v), cellPos(u + width - 1, v), cellPos(u + width - 1, v + height - 1), cellPos(u, v + height - 1)]
+                positions = removeNestings([translateFaceData(blockFaces[face][i * 3:i * 3 + 3], corners[i]) for i in range(4)])
+                tile = blockFaceTiles[look[0]][face]
+                vertices.extend(packQuad(positions, look[1], tile, width, height))
+        return vertices, None, faceCount
+
+    # Build the quad slot lookups (only chunks that actually get edited pay for these)
+    def buildQuadSlots(self):
+        if self.quadSlots is None:
+            self.quadKeys = [((x, y, z), face) for x, y, z, face in self.meshKeys.tolist()]
+            self.quadSlots = {key: slot for slot, key in enumerate(self.quadKeys)}
+            self.borderStart = None # Edits move quads around
+
+    def addQuad(self, key, vertices):
+        self.quadSlots[key] = len(self.quadKeys)
+        self.quadKeys.append(key)
+        self.mesh.addData(vertices)
+        self.faceCount += 1; self.quadCount += 1
+
+    # Remove a quad by moving the last quad of the mesh into its slot
+    def removeQuad(self, key):
+        slot = self.quadSlots.pop(key)
+        lastKey = self.quadKeys.pop()
+        if lastKey != key:
+            self.quadKeys[slot] = lastKey
+            self.quadSlots[lastKey] = slot
+            lastPos, lastFace = lastKey
+            self.mesh.updateData(slot * VALUES_PER_QUAD, self.genFaceVertices(lastPos, lastFace, self.getBlockID(lastPos)))
+        self.mesh.truncate(len(self.quadKeys) * VALUES_PER_QUAD)
+        self.faceCount -= 1; self.quadCount -= 1
+
+    # Re-mesh the block at pos and the 26 blocks around it (their visible faces and ambient occlusion can change)
+    @profile("Chunk.updateMeshAround(tuple)")
+    def updateMeshAround(self, pos: tuple):
+        positions = [addVectors(pos, offset) for offset in neighborhoodOffsets]
+        self.remeshBlocks(positions)
+        # Blocks on the other side of a chunk border belong to the neighboring chunk's mesh
+        if self.world is not None and any(self.toLocalPos(blockPos) is None for blockPos in positions):
+            for chunk in {self.world.getChunkAt(blockPos) for blockPos in positions} - {self, None}:
+                chunk.remeshBlocks(positions)
+
+    # Re-mesh the border columns (after a neighboring chunk was loaded, only those can see into it)
+    # Their quads are at the end of the mesh, so they get replaced with one upload
+    @profile("Chunk.remeshBorder()")
+    def remeshBorder(self):
+        if self.mesh is None:
+            return
+        if self.borderStart is None: # Greedy and edited meshes get re-meshed whole
+            self.reload()
+            return
+
+        x, y, z, faces, occlusion = self.findVisibleFaces(borderColumns)
+        self.mesh.truncate(self.borderStart * VALUES_PER_QUAD)
+        self.mesh.addData(packQuads(x, y, z, faces, occlusion, self.blocks[x, y, z]))
+        self.mesh.shrink()
+        self.meshKeys = np.concatenate([self.meshKeys[:self.borderStart], self.getMeshKeys(x, y, z, faces)])
+        self.faceCount = self.quadCount = len(self.meshKeys)
+
+    # Re-mesh a set of blocks (positions outside of the chunk are skipped)
+    def remeshBlocks(self, positions):
+        if self.mesh is None:
+            return
+        if self.meshKeys is None: # Greedy meshes can't be changed one block at a time
+            self.reload()
+            return
+
+        self.buildQuadSlots()
+        removed = list()
+        written = list()
+        for blockPos in positions:
+            if self.toLocalPos(blockPos) is None:
+                continue
+            quads = dict(self.genBlockQuads(blockPos))
+            for face in range(len(blockFaces)):
+                key = (blockPos, face)
+                if face in quads:
+                    written.append((key, quads[face]))
+                elif key in self.quadSlots:
+                    removed.append(key)
+        # Remove from the highest slot down, so the quad that gets moved into a hole is never one being removed
+        for key in sorted(removed, key=self.quadSlots.get, reverse=True):
+            self.removeQuad(key)
+        # Overwrite the quads that still exist and append the new ones
+        for key, vertices in written:
+            slot = self.quadSlots.get(key)
+            if slot is None:
+                self.addQuad(key, vertices)
+            else:
+                self.mesh.updateData(slot * VALUES_PER_QUAD, vertices)
+        # Hand memory back if a lot of faces were removed
+        self.mesh.shrink()
 
     # Reload chunk
     def reload(self):
-        # Clear the mesh's contents
-        del self.mesh
-        self.mesh = Mesh()
-        # Re-generate the mesh
+        # Re-generate the mesh (into the existing buffers)
         self.generateChunkMesh()
 
+    # Free the chunk's mesh, returns the chunk's data in the same format as genChunkData() so that it can be brought back
+    # with uploadMesh()
+    @profile("Chunk.unload()")
+    def unload(self):
+        meshKeys = self.meshKeys
+        if self.quadKeys is not None: # Edited since meshing
+            meshKeys = np.array([(*pos, face) for pos, face in self.quadKeys], dtype=np.int32).reshape(-1, 4)
+        vertices = None
+        if self.mesh is not None:
+            vertices = self.mesh.readData()
+            self.mesh.delete()
+            self.mesh = None
+        return self.blocks, vertices, meshKeys, self.faceCount
+
     # Update
     def updateChunk(self, dt):
         # We don't need delta time yet, but I'm adding it in case we need it later
         self.processQueueTick()
 
-    # Draw function
-    def Draw(self):
-        self.mesh.Draw()
+    # Draw function (World.Draw() draws all of the visible chunks at once instead)
+    def Draw(self, shader):
+        if self.mesh is not None:
+            chunkArena.Draw(shader, [self.mesh])
@@ -0,0 +1,57 @@
+# Imports
+# Default
+import math
+# Project Files
+from block import AIR
+
+from settings import CHUNK_SIZE, CHUNK_HEIGHT
+
+# Swept box vs block collision
+# A box moves one axis at a time (y, then x, then z). Along each axis every layer of blocks that its leading face passes
+# through is checked in order, and the box stops in front of the first layer with a solid block in it. Nothing is
+# skipped however far the box moves in one step, so fast bodies and long frames can't tunnel through blocks.
+# Blocks come straight from the world's chunk arrays, unloaded chunks count as air.
+COLLISION_EPSILON = 0.001 # Gap left between a box and the block it stopped at (so it isn't touching it next time)
+SWEEP_ORDER = (1, 0, 2)
+
+# Check if there's a solid (not air) block at a world space block position
+def isSolidBlock(world, x, y, z):
+    if y < 0 or y >= CHUNK_HEIGHT:
+        return False
+    blocks = world.getChunkBlocks((x // CHUNK_SIZE, z // CHUNK_SIZE))
+    return blocks is not None and blocks[x % CHUNK_SIZE, y, z % CHUNK_SIZE] != AIR
+
+# Check a layer of blocks, i is the layer's position on the axis, the other two axes are the box's block ranges
+def isLayerSolid(world, axis, i, ranges):
+    if axis == 0:
+        return any(isSolidBlock(world, i, y, z) for y in ranges[1] for z in ranges[2])
+    if axis == 1:
+        return any(isSolidBlock(world, x, i, z) for x in ranges[0] for z in ranges[2])
+    return any(isSolidBlock(world, x, y, i) for x in ranges[0] for y in ranges[1])
+
+# Get how far a box (from boxMin to boxMax) can move along one axis (up to distance), and whether it hit a block
+def sweepAxis(world, boxMin, boxMax, axis, distance):
+    if distance == 0:
+        return 0.0, False
+    # Blocks that the box overlaps on the other two axes
+    ranges = [range(math.floor(boxMin[a]), math.ceil(boxMax[a])) for a in range(3)]
+    if distance > 0:
+        for i in range(math.ceil(boxMax[axis]), math.ceil(boxMax[axis] + distance)):
+            if isLayerSolid(world, axis, i, ranges):
+                return max(0.0, i - boxMax[axis] - COLLISION_EPSILON), True
+    else:
+        for i in range(math.floor(boxMin[axis]) - 1, math.floor(boxMin[axis] + distance) - 1, -1):
+            if isLayerSolid(world, axis, i, ranges):
+                return min(0.0, i + 1 - boxMin[axis] + COLLISION_EPSILON), True
+    return distance, False
+
+# Move a box (position is its minimum corner) by a displacement without going into solid blocks
+# Returns the new position and which axes (x, y, z) hit a block
+def moveBox(world, position, size, displacement):
+    boxMin = [float(position[0]), float(position[1]), float(position[2])]
+    boxMax = [boxMin[0] + size[0], boxMin[1] + size[1], boxMin[2] + size[2]]
+    hits = [False, False, False]
+    for axis in SWEEP_ORDER:
+        moved, hits[axis] = sweepAxis(world, boxMin, boxMax, axis, float(displacement[axis]))
+        boxMin[axis] += moved; boxMax[axis] += moved
+    return boxMin, hits
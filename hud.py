@@ -0,0 +1,109 @@
+# Imports
+# Other
+import glm
+import numpy as np
+# Project Files
+from mesh import *
+from profiling import *
+
+from settings import FLOATS_PER_VERTEX
+
+# Colors (the reticle shader draws everything in one color, uColor)
+RETICLE_COLOR = glm.vec4(0.8, 0.8, 0.8, 1.0)
+UPDATE_COLOR = glm.vec4(0.2, 0.5, 1.0, 0.8)
+DRAW_COLOR = glm.vec4(0.3, 0.9, 0.3, 0.8)
+OTHER_COLOR = glm.vec4(0.9, 0.6, 0.1, 0.8) # Whatever is left of the frame (swapping buffers, waiting for vsync, ...)
+BUDGET_COLOR = glm.vec4(1.0, 0.2, 0.2, 0.9)
+CHUNK_LOAD_COLOR = glm.vec4(1.0, 1.0, 1.0, 0.9)
+
+# Graph layout in the reticle's orthographic space (y goes from -1 to 1, x from -aspect ratio to aspect ratio)
+GRAPH_MARGIN = 0.05
+GRAPH_WIDTH = 0.9
+BUDGET_HEIGHT = 0.25 # How high a frame that takes exactly the frame budget is
+MAX_BAR_HEIGHT = 3 * BUDGET_HEIGHT
+MARKER_HEIGHT = 0.02 # Chunk load marks under the bars
+
+# The parts of the graph, in drawing order
+graphColors = {"update": UPDATE_COLOR, "draw": DRAW_COLOR, "other": OTHER_COLOR, "chunkLoads": CHUNK_LOAD_COLOR,
+               "budget": BUDGET_COLOR}
+
+# Get the vertices (in the Mesh format) of quads from their edges, one quad per element
+def genQuadVertices(left, right, bottom, top):
+    n = len(left)
+    vertices = np.zeros((n, 4, FLOATS_PER_VERTEX), dtype=np.float32)
+    # Counter clockwise, like the reticle
+    vertices[:, :, 0] = np.stack([left, right, right, left], axis=1)
+    vertices[:, :, 1] = np.stack([bottom, bottom, top, top], axis=1)
+    vertices[:, :, 3] = 1.0
+    return vertices.ravel()
+
+# Frame time graph of the last frames, each bar is split into update, draw and other time with a line at the frame
+# budget, frames that uploaded chunks get a mark under their bar
+class FrameGraph:
+    def __init__(self, telemetry):
+        self.telemetry = telemetry
+        self.meshes = {name: Mesh() for name in graphColors}
+        self.aspectRatio = 1.0
+
+    def setAspectRatio(self, aspectRatio):
+        self.aspectRatio = aspectRatio
+
+    # Rebuild the bars from the telemetry's frames
+    @profile("FrameGraph.update()")
+    def update(self):
+        frames = self.telemetry.frames
+        numBars = frames.maxlen
+        n = len(frames)
+        if n == 0:
+            return
+
+        toHeight = lambda ms: np.minimum(np.array(ms, dtype=np.float32) * (BUDGET_HEIGHT / self.telemetry.budgetMs), MAX_BAR_HEIGHT)
+        frameMs = [frame["frameMs"] for frame in frames]
+        updateMs = [frame["updateMs"] for frame in frames]
+        drawMs = [frame["drawMs"] for frame in frames]
+        loaded = np.array([frame["chunksLoaded"] > 0 for frame in frames])
+
+        # Newest frame on the right
+        barWidth = GRAPH_WIDTH / numBars
+        x0 = -self.aspectRatio + GRAPH_MARGIN
+        y0 = -1.0 + GRAPH_MARGIN + MARKER_HEIGHT * 2
+        left = x0 + (numBars - n + np.arange(n, dtype=np.float32)) * barWidth
+        right = left + barWidth * 0.8
+
+        updateTop = y0 + toHeight(updateMs)
+        drawTop = np.maximum(y0 + toHeight(np.add(updateMs, drawMs)), updateTop)
+        frameTop = np.maximum(y0 + toHeight(frameMs), drawTop)
+        bars = {
+            "update": (left, right, np.full(n, y0, dtype=np.float32), updateTop),
+            "draw": (left, right, updateTop, drawTop),
+            "other": (left, right, drawTop, frameTop),
+            "chunkLoads": (left[loaded], right[loaded], np.full(loaded.sum(), y0 - MARKER_HEIGHT * 1.5, dtype=np.float32),
+                           np.full(loaded.sum(), y0 - MARKER_HEIGHT * 0.5, dtype=np.float32)),
+            "budget": ([x0], [x0 + GRAPH_WIDTH], [y0 + BUDGET_HEIGHT - 0.003], [y0 + BUDGET_HEIGHT + 0.003]),
+        }
+        for name, edges in bars.items():
+            mesh = self.meshes[name]
+            mesh.orphan()
+            mesh.addData(genQuadVertices(*edges))
+
+    # Draw with the reticle shader (which has to be in use with its orthographic projection set)
+    @profile("FrameGraph.Draw(ShaderProgram)")
+    def Draw(self, shader):
+        for name, mesh in self.meshes.items():
+            if mesh.drawLength > 0:
+                shader.setVec4("uColor", graphColors[name])
+                mesh.Draw()
+        shader.setVec4("uColor", RETICLE_COLOR)
+
+# Get a one line summary of the last frames for the window title
+def formatTelemetry(telemetry, numFrames = 30):
+    averages = telemetry.getAverages(numFrames)
+    if averages is None:
+        return ""
+    return ("%.1f ms (update %.1f, draw %.1f) | chunks %d drawn, %d culled | %.0fk vertices, %d draws, %d GL calls | "
+            "%.0fk faces in %.0fk quads | mesh memory %.1f of %.1f MB used | block queue %d, worker queue %d | %d hitches" % (
+            averages["frameMs"], averages["updateMs"], averages["drawMs"], averages["chunksDrawn"],
+            averages["chunksCulled"], averages["vertices"] / 1000, averages["drawCalls"], averages["glCalls"],
+            averages["faces"] / 1000, averages["quads"] / 1000,
+            averages["meshUsedBytes"] / (1024 * 1024), averages["meshAllocatedBytes"] / (1024 * 1024),
+            averages["blockQueue"], averages["workerQueue"], telemetry.hitches))
@@ -10,18 +10,21 @@ from mesh import *
 from shader import *
 from shader_data import *
 from profiling import *
+from telemetry import *
+from hud import *
+from raycast import *
 from window import *
 from textures import *
 
-from settings import MAX_INTERACTION_DIST, RAY_CAST_REFINES, STEPS_PER_RAY_UNIT
-from settings import PLAYER_HEIGHT, DAY_MINUTES
+from settings import PLAYER_HEIGHT, DAY_MINUTES, AO_CLIPPING_STRENGTH
+from settings import TICKS_PER_SECOND, MAX_TICKS_PER_FRAME, VSYNC
+from settings import SHOW_TELEMETRY, TELEMETRY_TITLE_INTERVAL
 
-import random
+import time
 
 # Generate skybox mesh based on a size parameter
+@profile("genSkyboxMesh(int)")
 def genSkyboxMesh(skyboxWidth = 1):
-    t = Timer("    genSkyboxMesh(int)")
-
     # Get coordinates of the two main corners
     x, y, z = (-skyboxWidth / 2, ) * 3
     X, Y, Z = ( skyboxWidth / 2, ) * 3
@@ -57,9 +60,8 @@ def genSkyboxMesh(skyboxWidth = 1):
     return mesh
 
 # Generate sun and moon for the sky vertices based on a size parameter
+@profile("genSunMoonMesh(int, float, float)")
 def genSunMoonMesh(sunMoonDist = 700, sunScale = 0.5, moonScale = 0.375):
-    t = Timer("    genSunMoonMesh(int, float, float)")
-
     # Get coordinates of the two main corners
     x = -sunMoonDist / 2
     X =  sunMoonDist / 2
@@ -81,9 +83,8 @@ def genSunMoonMesh(sunMoonDist = 700, sunScale = 0.5, moonScale = 0.375):
     return mesh
 
 # Reticle
+@profile("genReticleMesh(float)")
 def genReticleMesh(size = 0.05):
-    t = Timer("    genSunMoonMesh(int, float, float)")
-
     x = -size / 2
     X =  size / 2
     m =  size / 10
@@ -102,80 +103,48 @@ def genReticleMesh(size = 0.05):
     mesh = Mesh(vertices)
     return mesh
 
-class rayEnd:
-    def __init__(self, found : bool, dirUsed : tuple, position : tuple, prevPosition : tuple):
-        self.foundPos = found
-        self.dir = dirUsed
-        self.position = toBlockPos(position)
-        self.previousBlock = toBlockPos(prevPosition)
-
-def rayCast(startPos : glm.vec3, direction : glm.vec3, chunk : Chunk, findBreakPos = True):
-    found = False
-
-    dir = glm.normalize(direction)
-    multiplier = 1.0 / STEPS_PER_RAY_UNIT
-
-    r = rayEnd(False, dir, startPos, startPos)
-
-    endPos = startPos.xyz
-    refineStart = endPos
-
-    for _ in range(MAX_INTERACTION_DIST * STEPS_PER_RAY_UNIT):
-        endPos += multiplier * dir
-        found = chunk.checkBlock(toBlockPos(endPos))
-
-        if found:
-            refineStart = endPos - multiplier * dir
-            break
-
-    # Make the steps smaller and go back a little to try and find a closer estimate for the position
-    if found:
-        multiplier /= 2
-        refinePos = refineStart
-        rFound = False
-        prevPos = refineStart
-        for _ in range(RAY_CAST_REFINES):
-            refinePos += multiplier * dir
-            rFound = chunk.checkBlock(toBlockPos(refinePos))
-
-            if rFound:
-                endPos.xyz = refinePos.xyz
-                refinePos -= multiplier * dir
-                multiplier /= 2
-            else:
-                prevPos = refinePos
-
-        r = rayEnd(True, dir, endPos, prevPos)
-
-    return r
-
 # Window subclass
 class GameWindow(Window):
     # Variables
     mouseLocked = False
 
+    @profile("Window.__init__()")
     def __init__(self, *args, **kwargs):
-        t = Timer("Window.__init__()")
-
         # Setup parent class constructor
+        kwargs.setdefault("vsync", VSYNC)
+        kwargs.setdefault("ticksPerSecond", TICKS_PER_SECOND)
+        kwargs.setdefault("maxTicksPerFrame", MAX_TICKS_PER_FRAME)
         super().__init__(*args, **kwargs)
 
-        # Schedule the update function
+        # Schedule the simulation (fixed ticks) and the update function (every frame)
+        self.addTick(self.Tick)
         self.addLoop(self.Update)
 
         # Game and world
-        self.chunk = Chunk(0, 0, random.randint(0, 1000000))
+        self.world = World(getWorldSeed())
+        self.world.loadChunk(0, 0) # The spawn chunk is loaded right away so that there's ground to stand on
         self.camera = Camera((0.0, MAX_HEIGHT + 4, 0.0), (0, 90, 0))
         self.player = Player(self.camera)
         self.time = 0
+        self.previousTime = 0 # Time at the tick before, rendering uses a time between the two (renderTime)
+        self.renderTime = 0
 
         # Block and debug shaders
-        self.blockShader = ShaderProgram(vertexCode, blockFragmentCode)
+        # Camera and time of day data for all of the shaders
+        self.cameraUniforms = CameraUniformBuffer()
+        self.blockShader = ShaderProgram(chunkVertexCode, blockFragmentCode)
         self.debugShader = ShaderProgram(debugVertexCode, debugFragmentCode)
+        self.blockShader.use()
+        self.blockShader.setFloat("uAOStrength", AO_CLIPPING_STRENGTH)
 
         # Block usage slot
         self.blockUseIndex = 0
 
+        # Frame telemetry (F3 shows it)
+        self.telemetry = createTelemetry()
+        self.showTelemetry = SHOW_TELEMETRY
+        self.lastTitleUpdate = 0
+
         # Skybox setup
         self.setupSkybox()
         # GUI
@@ -193,6 +162,7 @@ class GameWindow(Window):
             self.OrthoProjectionMatrix = glm.ortho(-aspectRatio, aspectRatio, -1.0, 1.0)
             self.reticleShader.use()
             self.reticleShader.setMat4("projectionMatrix", self.OrthoProjectionMatrix)
+            self.frameGraph.setAspectRatio(aspectRatio)
 
     def setupSkybox(self):
         # Skybox, sun, and moon
@@ -206,6 +176,8 @@ class GameWindow(Window):
         # Reticle stuff
         self.reticle = genReticleMesh()
         self.reticleShader = ShaderProgram(reticleVertexCode, reticleFragmentCode)
+        # Telemetry overlay
+        self.frameGraph = FrameGraph(self.telemetry)
         self.setup2DProjection(self.width, self.height)
 
     def setupTextures(self):
@@ -215,7 +187,7 @@ class GameWindow(Window):
         # Set their uniforms so later they only need to be bound
         # Texture atlas
         self.blockShader.use()
-        self.sunMoonShader.setTexture2D("uTextureAtlas", self.TEXTURE_ATLAS.id, 0)
+        self.blockShader.setTexture2D("uTextureAtlas", self.TEXTURE_ATLAS.id, 0)
         glActiveTexture(GL_TEXTURE0)
         glBindTexture(GL_TEXTURE_2D, self.TEXTURE_ATLAS.id)
         # Celestial bodies
@@ -237,19 +209,23 @@ class GameWindow(Window):
 
     def onUserMousePress(self, button, mods):
         if button == GLFW_MOUSE_BUTTON_1:
-            r = rayCast(self.camera.pos, self.camera.Front, self.chunk)
-            if r.foundPos:
-                self.chunk.addBlockToQueue(r.position, None)
+            r = rayCast(self.world, self.camera.pos, self.camera.Front)
+            if r.hit:
+                self.world.addBlockToQueue(r.position, AIR)
         if button == GLFW_MOUSE_BUTTON_2:
-            r = rayCast(self.camera.pos, self.camera.Front, self.chunk, False)
-            if r.foundPos:
-                self.chunk.addBlockToQueue(r.previousBlock, blockList[self.blockUseIndex])
+            r = rayCast(self.world, self.camera.pos, self.camera.Front)
+            if r.hit and r.normal != (0, 0, 0): # Not when the camera is inside of the block
+                self.world.addBlockToQueue(r.placePosition, blockList[self.blockUseIndex])
 
     # Parent class keyboard input function overload
     def onUserKeyPress(self, key, mods):
         if key == GLFW_KEY_ESCAPE:
             self.mouseLocked = not self.mouseLocked
             self.setCursorDisabled(self.mouseLocked)
+        if key == GLFW_KEY_F3:
+            self.showTelemetry = not self.showTelemetry
+            if not self.showTelemetry:
+                glfwSetWindowTitle(self.window, self.caption)
         # Pass the key input to the camera
         if self.mouseLocked:
             self.player.processKeyInput(key, mods, True) # Tells it that the keys are being pressed
@@ -258,42 +234,68 @@ class GameWindow(Window):
         # Pass the key input to the camera
         self.player.processKeyInput(key, mods, False) # Tells it that the keys are being released
 
-    def Update(self):
-        t = Timer("    Window.Update()")
-
-        dt = self.getTimeInterval()
+    # The frame starts before its ticks so that they count towards it
+    def runTicks(self):
+        self.frame = self.telemetry.beginFrame()
+        super().runTicks()
 
-        # Update chunk
-        self.chunk.updateChunk(dt)
+    # One fixed length step of the simulation, always tickLength seconds so it doesn't depend on the frame rate
+    @profile("Window.Tick()")
+    def Tick(self):
+        dt = self.tickLength
+        # Update chunks
+        self.world.updateBlocks(dt)
 
-        self.player.updateAABS(dt)
-        self.player.CollideWithChunk(self.chunk)
-        self.player.updateCameraPosition()
+        self.player.tick(self.world, dt)
 
-        # Tell the chunk loader that it can now load a chunk
-        #self.world.updateChunks(self.camera.pos)
         # Add to time variable
+        self.previousTime = self.time
         self.time += dt / (60 * DAY_MINUTES)
         self.time = self.time % 360
 
-        # Draw
-        self.Draw(dt)
+    @profile("Window.Update()")
+    def Update(self):
+        frame = self.frame
+        updateStart = time.perf_counter()
 
-    def Draw(self, dt):
-        t = Timer("    Window.Draw(float)")
+        # Render between the last two ticks
+        self.player.interpolate(self.tickAlpha)
+        self.renderTime = self.previousTime + self.tickAlpha * self.tickLength / (60 * DAY_MINUTES)
 
+        # Tell the chunk loader that it can now load chunks
+        self.world.updateChunks(self.camera.pos)
+
+        # Draw
+        drawStart = time.perf_counter()
+        self.Draw(self.frameTime)
+
+        # Telemetry (the draw time is how long submitting took, the GPU works on it after that)
+        frame["ticks"] = self.frameTicks
+        frame["updateMs"] = (self.tickTime + drawStart - updateStart) * 1000
+        frame["drawMs"] = (time.perf_counter() - drawStart) * 1000
+        frame["chunksDrawn"] = self.world.chunksDrawn; frame["chunksCulled"] = self.world.chunksCulled
+        frame["blockQueue"] = self.world.getBlockQueueSize()
+        frame["workerQueue"] = len(self.world.pending)
+        frame["faces"], frame["quads"] = self.world.getMeshStats()
+        frame["meshAllocatedBytes"], frame["meshUsedBytes"] = self.world.getMeshMemory()
+        if self.showTelemetry and time.perf_counter() - self.lastTitleUpdate > TELEMETRY_TITLE_INTERVAL:
+            glfwSetWindowTitle(self.window, "%s | %s" % (self.caption, formatTelemetry(self.telemetry)))
+            self.lastTitleUpdate = time.perf_counter()
+
+    @profile("Window.Draw(float)")
+    def Draw(self, dt):
         # Clear the screen
         glClearColor(1.0, 0.0, 1.0, 1.0)
         self.clear()
 
+        # Camera and sun height for every shader
+        self.camera.setUniformBuffer(self.cameraUniforms, self.width / self.height, self.renderTime, (math.sin(-self.renderTime) + 1.0) / 2)
+
         ### Draw the skybox and moon/sun with no depth testing ###
         # Disable depth testing
         glDisable(GL_DEPTH_TEST)
         # Set uniforms
         self.skyShader.use() # Use it the sky shader, obviously
-        self.camera.setUniformsSkybox(self.skyShader, self.width / self.height)
-        # Sun height
-        self.skyShader.setFloat("sunHeight", (math.sin(-self.time) + 1.0) / 2)
         # Model matrix
         model = glm.mat4(1.0)
         self.skyShader.setMat4("modelMatrix", model)
@@ -303,11 +305,9 @@ class GameWindow(Window):
         # Draw the sun and moon
         # Set uniforms
         self.sunMoonShader.use() # Use it the sky shader, obviously
-        # Sun and moon textures
-        self.camera.setUniformsSkybox(self.sunMoonShader, self.width / self.height)
         # Model matrix
         model = glm.mat4(1.0)
-        model = glm.rotate(model, -self.time, glm.vec3(0, 0, 1))
+        model = glm.rotate(model, -self.renderTime, glm.vec3(0, 0, 1))
         self.sunMoonShader.setMat4("modelMatrix", model)
         # Draw the mesh
         self.sunMoonMesh.Draw()
@@ -318,20 +318,12 @@ class GameWindow(Window):
         glEnable(GL_DEPTH_TEST)
         # Use the shader
         self.blockShader.use()
-        # Set uniforms
-        # Camera
-        self.camera.setUniforms(self.blockShader, self.width / self.height)
-        self.blockShader.setFloat("uSunHeight", (math.sin(-self.time) + 1.0) / 2)
-        # Model Matrix
-        model = glm.mat4(1.0)
-        self.blockShader.setMat4("modelMatrix", model)
-        # Draw the mesh
-        self.chunk.Draw()
+        # Draw the world
+        self.world.Draw(self.blockShader, self.camera, self.width / self.height)
 
         """ Debug Boxes (for camera AABB stuff)
         # Debug Boxes/Lines
         self.debugShader.use()
-        self.camera.setUniforms(self.debugShader, self.width / self.height)
         self.player.DrawDebug(self.debugShader)
         """
 
@@ -340,6 +332,10 @@ class GameWindow(Window):
         glDisable(GL_DEPTH_TEST)
         self.reticleShader.use()
         self.reticle.Draw()
+        # Telemetry overlay
+        if self.showTelemetry:
+            self.frameGraph.update()
+            self.frameGraph.Draw(self.reticleShader)
 
 
 if __name__ == '__main__':
@@ -352,3 +348,9 @@ if __name__ == '__main__':
     glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
 
     window.gameLoop()
+    window.world.close()
+    window.telemetry.close()
+    # Profiling results (see profiling.py)
+    if profiler.enabled:
+        profiler.printStats()
+        profiler.exportChromeTrace()
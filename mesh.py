@@ -1,35 +1,66 @@
 # Imports
 from OpenGL.GL import *
 from profiling import *
+from telemetry import frameCounters
 
-from settings import CHUNK_SIZE, MAX_HEIGHT, FLOATS_PER_VERTEX, FLOATS_PER_DEBUG_VERTEX,\
-    VERTS_PER_BLOCK, INDICES_PER_FACE
-# Temp settings
-facesPerBlock = 6
+from settings import FLOATS_PER_VERTEX, FLOATS_PER_DEBUG_VERTEX, INDICES_PER_FACE, UINTS_PER_PACKED_VERTEX
 
 from ctypes import sizeof, c_void_p
+import numpy as np
 
-def toGLfloats(array : list):
-    return (GLfloat * len(array))(*array)
-def toGLuints(array : list):
-    return (GLuint * len(array))(*array)
+# Get a contiguous buffer that OpenGL can read from directly
+# Buffers that already have the right type (array('f'/'I'), memoryviews of them, numpy arrays) aren't copied, lists
+# are converted in one go
+def toGLBuffer(values, dtype):
+    return np.ascontiguousarray(values, dtype=dtype)
 
 # List nesting removal function
 def removeNestings(l):
     return [item for sublist in l for item in sublist]
 
-def genIndices(NumVertices : int):
+# The 6 indices of the 2 triangles of a quad
+quadIndexPattern = np.array([0, 1, 2, 2, 3, 0], dtype=np.uint32)
+
+# Get the indices that draw a number of quads (quad i uses vertices 4i to 4i + 3)
+def genQuadIndices(numQuads : int):
+    return (np.arange(numQuads, dtype=np.uint32)[:, None] * 4 + quadIndexPattern).ravel()
+
+# Every Mesh is made of quads, so they all share one index buffer
+class QuadIndexBuffer:
+    def __init__(self):
+        self.EBO = None # Created on first use, there's no OpenGL context when this module is imported
+        self.numQuads = 0
+
+    # Make sure there are indices for at least numQuads quads
+    # The buffer keeps its name when it grows, so the VAOs that use it don't have to rebind it
+    @profile("QuadIndexBuffer.reserve(int)")
+    def reserve(self, numQuads):
+        if self.EBO is None:
+            self.EBO = GLuint(0)
+            glGenBuffers(1, self.EBO)
+        if numQuads <= self.numQuads and self.numQuads > 0:
+            return
+
+        self.numQuads = max(numQuads, self.numQuads * 2, 1)
+        indices = genQuadIndices(self.numQuads)
+        # Upload through the copy target, the element array binding belongs to whichever VAO is bound
+        glBindBuffer(GL_COPY_WRITE_BUFFER, self.EBO)
+        glBufferData(GL_COPY_WRITE_BUFFER, indices.nbytes, indices, GL_STATIC_DRAW)
+
+    # Attach the buffer to the bound VAO
+    def bind(self):
+        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
 
-    # Loop Through starter vertices
-    indices = []
-    for i in range(NumVertices // 4):
-        i0 = i * 4
-        indices += [i0 + j for j in range(3)]
-        indices.append(i0 + 2)
-        indices.append(i0 + 3)
-        indices.append(i0)
+    def getAllocatedBytes(self):
+        return self.numQuads * INDICES_PER_FACE * sizeof(GLuint)
 
-    return indices
+quadIndices = QuadIndexBuffer()
+
+# Pack a chunk vertex into 2 uints
+# First:  x (5 bits) | y (9 bits) | z (5 bits) | ambient occlusion level (2 bits), the position is chunk local
+# Second: texture tile x (4 bits) | tile y (4 bits) | u (9 bits) | v (9 bits), u and v count tiles across the quad
+def packChunkVertex(x, y, z, occlusion, tileX, tileY, u, v):
+    return [x | (y << 5) | (z << 14) | (occlusion << 19), tileX | (tileY << 4) | (u << 8) | (v << 17)]
 
 def genLineIndices(NumVertices: int):
     indices = []
@@ -44,50 +75,41 @@ class MeshError(Exception):
     pass
 
 class Mesh:
+    # Vertex format
+    valuesPerVertex = FLOATS_PER_VERTEX
+    valueType = GLfloat
+    valueDtype = np.float32
+    vertexFormatHelp = ("Make sure there are 6 floats contained in each vertex:\n"
+                        "    3 for position.xyz,\n"
+                        "    1 for brightness,\n"
+                        "    and 2 for texture coordinates xy/st/uv.")
+
+    @profile("Mesh.__init__(list, list)")
     def __init__(self, vertices = None):
-        t = Timer("Mesh.__init__(list, list)")
-
         if vertices is None:
             vertices = list()
 
-        if not len(vertices) % FLOATS_PER_VERTEX == 0:
-            raise MeshError("Make sure there are 6 floats contained in each vertex:\n"
-                            "    3 for position.xyz,\n"
-                            "    1 for brightness,\n"
-                            "    and 2 for texture coordinates xy/st/uv."
-            )
-
-        indices = genIndices(len(vertices) // FLOATS_PER_VERTEX)
-        self.drawLength = len(indices)
+        if not len(vertices) % self.valuesPerVertex == 0:
+            raise MeshError(self.vertexFormatHelp)
 
-        # Declare VAO and VBO
-        self.VAO = GLuint(0); self.VBO = GLuint(0); self.EBO = GLuint(0)
+        self.drawLength = (len(vertices) // self.valuesPerVertex // 4) * INDICES_PER_FACE
 
-        self.vertexSize = FLOATS_PER_VERTEX * sizeof(GLfloat)
-        self.EndIndex = sizeof(GLfloat) * len(vertices)
+        # Declare VAO and VBO (the index buffer is shared, see QuadIndexBuffer)
+        self.VAO = GLuint(0); self.VBO = GLuint(0)
 
-        self.setupMesh(vertices, indices)
+        self.vertexSize = self.valuesPerVertex * sizeof(self.valueType)
+        self.EndIndex = len(vertices) # In values, not bytes
+        # How many vertices the buffers have room for (they grow as data gets added)
+        self.capacity = len(vertices) // self.valuesPerVertex
 
-    def setupMesh(self, vertexData, indices):
-        t = Timer("    Mesh.setupMesh()")
+        self.setupMesh(vertices)
 
-        glGenVertexArrays(1, self.VAO)
-        glGenBuffers(1, self.VBO)
-        glGenBuffers(1, self.EBO)
+    def toGLValues(self, values):
+        return toGLBuffer(values, self.valueDtype)
 
-        glBindVertexArray(self.VAO)
-
-        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
-
-        VBOAllocSpace = len(vertexData)
-        VBOData = toGLfloats(vertexData)
-        if VBOAllocSpace == 0:
-            VBOAllocSpace = CHUNK_SIZE * CHUNK_SIZE * MAX_HEIGHT * FLOATS_PER_VERTEX * VERTS_PER_BLOCK # The maximum number of vertex floats for a chunk
-            VBOData = None # Just allocates the space with no data
-
-        glBufferData(GL_ARRAY_BUFFER, VBOAllocSpace * sizeof(GLfloat), VBOData, GL_DYNAMIC_DRAW)
-
-        vertSize = FLOATS_PER_VERTEX * sizeof(GLfloat)
+    # Vertex attributes
+    def setupAttributes(self):
+        vertSize = self.vertexSize
 
         # Position
         glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, vertSize, c_void_p(0))
@@ -101,71 +123,136 @@ class Mesh:
         glVertexAttribPointer(2, 2, GL_FLOAT, GL_FALSE, vertSize, c_void_p(4 * sizeof(GLfloat)))
         glEnableVertexAttribArray(2)
 
-        # Element Buffer Object
-        EBOAllocSpace = len(indices)
-        EBOData = toGLuints(indices)
-        if EBOAllocSpace == 0:
-            EBOAllocSpace = CHUNK_SIZE * CHUNK_SIZE * MAX_HEIGHT * INDICES_PER_FACE * facesPerBlock # The max number of indices for a chunk
-            EBOData = None
+    @profile("Mesh.setupMesh()")
+    def setupMesh(self, vertexData):
+        quadIndices.reserve(self.capacity // 4)
 
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, EBOAllocSpace * sizeof(GLuint), EBOData, GL_STATIC_DRAW)
+        glGenVertexArrays(1, self.VAO)
+        glGenBuffers(1, self.VBO)
+
+        glBindVertexArray(self.VAO)
+
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+
+        # Only allocate what the data needs (an empty mesh allocates nothing until data is added)
+        VBOData = self.toGLValues(vertexData) if len(vertexData) > 0 else None
+        glBufferData(GL_ARRAY_BUFFER, len(vertexData) * sizeof(self.valueType), VBOData, GL_DYNAMIC_DRAW)
+
+        self.setupAttributes()
+
+        # Element Buffer Object
+        quadIndices.bind()
 
         # Unbind
         glBindVertexArray(0)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
     def orphan(self):
         glBindVertexArray(self.VAO)
-        # Vertex buffer
+        # Vertex buffer (keeps its current capacity)
         glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        glBufferData(GL_ARRAY_BUFFER, self.capacity * self.vertexSize, None, GL_DYNAMIC_DRAW)
 
-        VBOAllocSpace = CHUNK_SIZE * CHUNK_SIZE * MAX_HEIGHT * FLOATS_PER_VERTEX * VERTS_PER_BLOCK  # The maximum number of vertex floats for a chunk
-        glBufferData(GL_ARRAY_BUFFER, VBOAllocSpace * sizeof(GLfloat), None, GL_DYNAMIC_DRAW)
-
-        # Index buffer
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
-
-        EBOAllocSpace = CHUNK_SIZE * CHUNK_SIZE * MAX_HEIGHT * INDICES_PER_FACE * facesPerBlock  # The max number of indices for a chunk
-        glBufferData(GL_ELEMENT_ARRAY_BUFFER, EBOAllocSpace * sizeof(GLuint), None, GL_DYNAMIC_DRAW)
-
+        glBindVertexArray(0)
         # Reset draw Length
         self.drawLength = 0
         self.EndIndex = 0
 
-    # TODO: Fix this.
+    # Read the used vertex values back from the GPU
+    def readData(self):
+        data = np.empty(self.EndIndex, dtype=self.valueDtype)
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        glGetBufferSubData(GL_ARRAY_BUFFER, 0, data.nbytes, data.view(np.uint8))
+        return data
+
+    # Free the mesh's GPU memory (the mesh can't be drawn after this)
+    def delete(self):
+        glDeleteVertexArrays(1, self.VAO)
+        glDeleteBuffers(1, self.VBO)
+        self.capacity = 0
+        self.truncate(0)
+
+    # Buffer sizes (not counting the shared index buffer)
+    def getAllocatedBytes(self):
+        return self.capacity * self.vertexSize
+
+    def getUsedBytes(self):
+        return self.EndIndex * sizeof(self.valueType)
+
+    # Copy the used part of a buffer into a new buffer of a different size and delete the old one
+    def reallocateBuffer(self, buffer, usedBytes, newBytes):
+        newBuffer = GLuint(0)
+        glGenBuffers(1, newBuffer)
+        glBindBuffer(GL_COPY_WRITE_BUFFER, newBuffer)
+        glBufferData(GL_COPY_WRITE_BUFFER, newBytes, None, GL_DYNAMIC_DRAW)
+        if usedBytes > 0:
+            glBindBuffer(GL_COPY_READ_BUFFER, buffer)
+            glCopyBufferSubData(GL_COPY_READ_BUFFER, GL_COPY_WRITE_BUFFER, 0, 0, usedBytes)
+        glDeleteBuffers(1, buffer)
+        return newBuffer
+
+    # Change how many vertices the buffers can hold (keeping the data that's already in them)
+    @profile("Mesh.resize(int)")
+    def resize(self, capacity):
+        self.capacity = capacity
+        quadIndices.reserve(self.capacity // 4)
+        glBindVertexArray(self.VAO)
+        # Vertex buffer (the attributes have to be pointed at the new buffer)
+        self.VBO = self.reallocateBuffer(self.VBO, self.EndIndex * sizeof(self.valueType), self.capacity * self.vertexSize)
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        self.setupAttributes()
+        glBindVertexArray(0)
+
+    # Make room for a number of vertices, at least doubling the capacity so that appending stays cheap
+    def reserve(self, numVertices):
+        if numVertices > self.capacity:
+            self.resize(max(numVertices, self.capacity * 2))
+
+    # Give memory back after large deletions (when less than a quarter of the capacity is used)
+    def shrink(self):
+        usedVertices = self.EndIndex // self.valuesPerVertex
+        if usedVertices * 4 < self.capacity:
+            self.resize(usedVertices * 2)
+
+    # Append vertices to the end of the mesh
+    @profile("Mesh.addData(list)")
     def addData(self, vertices):
-        t = Timer("    Mesh.addData(list)")
+        if len(vertices) == 0:
+            return
+        self.reserve((self.EndIndex + len(vertices)) // self.valuesPerVertex)
 
         glBindVertexArray(self.VAO)
 
         # Vertex Buffer
         glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
         # Submit
-        glBufferSubData(GL_ARRAY_BUFFER, self.EndIndex * sizeof(GLfloat), len(vertices) * sizeof(GLfloat), toGLfloats(vertices))
-        self.EndIndex += len(vertices)
+        valueSize = sizeof(self.valueType)
+        glBufferSubData(GL_ARRAY_BUFFER, self.EndIndex * valueSize, len(vertices) * valueSize, self.toGLValues(vertices))
+        self.truncate(self.EndIndex + len(vertices)) # The shared index buffer already covers the new quads
 
-        # Index Buffer
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
-        # Submit Data
-        indices = genIndices(len(vertices) // FLOATS_PER_VERTEX)
-        glBufferSubData(GL_ELEMENT_ARRAY_BUFFER, self.drawLength * sizeof(GLuint), len(indices) * sizeof(GLuint), toGLuints(indices))
+        glBindVertexArray(0)
 
-        self.drawLength += len(indices)
+    # Overwrite vertices that are already in the mesh, starting at a value offset
+    @profile("Mesh.updateData(int, list)")
+    def updateData(self, offset, vertices):
+        valueSize = sizeof(self.valueType)
+        glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
+        glBufferSubData(GL_ARRAY_BUFFER, offset * valueSize, len(vertices) * valueSize, self.toGLValues(vertices))
 
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
+    # Drop everything past a value offset (or move the end forward after appending)
+    def truncate(self, length):
+        self.EndIndex = length
+        self.drawLength = (length // self.valuesPerVertex // 4) * INDICES_PER_FACE
 
+    @profile("Mesh.Draw()")
     def Draw(self):
-        t = Timer("    Mesh.Draw()")
-
         glBindVertexArray(self.VAO)
-        glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
         glDrawElements(GL_TRIANGLES, self.drawLength, GL_UNSIGNED_INT, None)
+        frameCounters.drawCalls += 1; frameCounters.glCalls += 2
+        frameCounters.vertices += self.EndIndex // self.valuesPerVertex
 
 class DebugMesh:
+    @profile("DebugMesh.__init__(list)")
     def __init__(self, vertices, indices):
-        t = Timer("DebugMesh.__init__(list)")
-
         if vertices is None:
             vertices = list()
 
@@ -185,9 +272,8 @@ class DebugMesh:
 
         self.setupMesh(vertices, indices)
 
+    @profile("DebugMesh.setupMesh()")
     def setupMesh(self, vertexData, indices):
-        t = Timer("    DebugMesh.setupMesh()")
-
         glGenVertexArrays(1, self.VAO)
         glGenBuffers(1, self.VBO)
         glGenBuffers(1, self.EBO)
@@ -197,7 +283,7 @@ class DebugMesh:
         glBindBuffer(GL_ARRAY_BUFFER, self.VBO)
 
         VBOAllocSpace = len(vertexData)
-        VBOData = toGLfloats(vertexData)
+        VBOData = toGLBuffer(vertexData, np.float32)
         if VBOAllocSpace == 0:
             VBOAllocSpace = FLOATS_PER_DEBUG_VERTEX * 256
             VBOData = None  # Just allocates the space with no data
@@ -216,7 +302,7 @@ class DebugMesh:
 
         # Element Buffer Object
         EBOAllocSpace = len(indices)
-        EBOData = toGLuints(indices)
+        EBOData = toGLBuffer(indices, np.uint32)
         if EBOAllocSpace == 0:
             EBOAllocSpace = INDICES_PER_FACE * 2 * 256
             EBOData = None
@@ -228,9 +314,9 @@ class DebugMesh:
         glBindVertexArray(0)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, 0)
 
+    @profile("DebugMesh.Draw()")
     def Draw(self):
-        t = Timer("    DebugMesh.Draw()")
-
         glBindVertexArray(self.VAO)
         glBindBuffer(GL_ELEMENT_ARRAY_BUFFER, self.EBO)
-        glDrawElements(GL_LINES, self.drawLength, GL_UNSIGNED_INT, None)
\ No newline at end of file
+        glDrawElements(GL_LINES, self.drawLength, GL_UNSIGNED_INT, None)
+        frameCounters.drawCalls += 1; frameCounters.glCalls += 3
\ No newline at end of file
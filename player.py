@@ -2,6 +2,7 @@
 from camera import *
 from AABB import *
 from chunk import *
+from collision import moveBox
 # Settings
 from settings import PLAYER_COLLISION_HEIGHT, PLAYER_COLLISION_WIDTH, PLAYER_HEIGHT,\
     JUMP_POWER, MOVEMENT_SPEED, SPRINT_SPEED, COLLISION_DAMPING
@@ -21,37 +22,40 @@ class Player:
 
         self.physBox = AABB(self.camera.pos, glm.vec3(1.0), glm.vec3(1.0, 0.0, 0.0))
         self.physBox.active = True
-
-        self.CurrentBlockBoxes = list()
-
-    def CollideWithChunk(self, chunk):
-        checkPositions = []
-        for x in range(-1, math.ceil(self.collisionBox.dimensions.x + 1)):
-            for z in range(-1, math.ceil(self.collisionBox.dimensions.z + 1)):
-                for y in range(-1, math.ceil(self.collisionBox.dimensions.y + 1)):
-                    checkPositions.append(toBlockPos(glm.vec3(x, y, z) + self.collisionBox.position))
-
-        self.CurrentBlockBoxes = [AABB(p + glm.vec3(0.5), glm.vec3(1.0)) for p in checkPositions]
-        # FOR DEBUGGING ONLY!!!
-        #self.CurrentBlockBoxes = [AABB(p + glm.vec3(0.5), glm.vec3(1.0), glm.vec3(1.0, 0.0, 1.0)) for p in checkPositions]
-        for box in self.CurrentBlockBoxes:
-            if chunk.checkBlock(toBlockPos(box.position)):
-                collData = self.collisionBox.GetCollisionData(box)
-                if collData.colliding:
-                    # Adjust collision box position
-                    self.collisionBox.position += collData.correctionVector
-                    # Replace camera position accordingly
-                    self.updateCameraPosition()
-                    # Update physics box
-                    self.physBox.setPosition(self.camera.pos)
-                    # Set the physics velocity for the collision
-                    self.physBox.velocity[collData.collisionAxis] = 0.0
-                    # This is temporary!!! (maybe. It's just not good practice)
-                    if collData.collisionAxis != 1:
-                        self.camera.sprint = False
+        self.onGround = False
+
+    # Move by the velocity (over dt seconds) without going into the world's blocks
+    def CollideWithWorld(self, world, dt):
+        displacement = self.physBox.velocity * dt
+        position, hits = moveBox(world, self.collisionBox.position, self.collisionBox.dimensions, displacement)
+        self.collisionBox.position = glm.vec3(*position)
+        # Stop on the axes that hit something
+        for axis in range(3):
+            if hits[axis]:
+                self.physBox.velocity[axis] = 0.0
+        self.onGround = hits[1] and displacement.y < 0
+        # This is temporary!!! (maybe. It's just not good practice)
+        if hits[0] or hits[2]:
+            self.camera.sprint = False
+        # Replace camera position accordingly and move the physics box along
+        self.updateCameraPosition()
+        self.physBox.setPosition(self.camera.pos)
         self.physBox.reloadDebugModelMatrix()
         self.collisionBox.reloadDebugModelMatrix()
 
+    # One fixed length step of movement (dt is the tick length)
+    def tick(self, world, dt):
+        self.collisionBox.storePreviousPosition()
+        self.physBox.storePreviousPosition()
+        self.updateAABS(dt)
+        self.CollideWithWorld(world, dt)
+
+    # Put the camera and boxes part of the way (alpha, 0 to 1) between the last two ticks for rendering
+    def interpolate(self, alpha):
+        self.updateCameraPosition(self.collisionBox.getInterpolatedPosition(alpha))
+        self.collisionBox.reloadDebugModelMatrix(alpha)
+        self.physBox.reloadDebugModelMatrix(alpha)
+
     def processKeyInput(self, key, mods, state):
         self.camera.processKeyInput(key, mods, state)
 
@@ -74,32 +78,28 @@ class Player:
             horizontalMotion = horizontalMotion * MOVEMENT_SPEED
 
         if self.camera.up:
-            if self.physBox.velocity.y == 0:
+            if self.onGround:
                 self.physBox.velocity.y = JUMP_POWER
+                self.onGround = False
 
         self.physBox.velocity.x = horizontalMotion.x
         self.physBox.velocity.z = horizontalMotion.z
 
-        self.physBox.update(dt)
+        # Gravity (CollideWithWorld() does the moving)
+        self.physBox.velocity += self.physBox.acceleration * dt
 
     def updateAABS(self, dt):
         # Update camera movement box vectors
         self.updateCameraPhysics(dt)
 
-        # Set the bounding box position to be the camera position
-        self.collisionBox.setPosition(self.physBox.position + self.physBox.dimensions / 2 - glm.vec3(0.0, PLAYER_HEIGHT
-                                      - PLAYER_COLLISION_HEIGHT / 2, 0.0))
-        self.collisionBox.update(dt)
-
-    def updateCameraPosition(self):
+    def updateCameraPosition(self, boxPosition = None):
         # Set the camera position to be the bounding box position
-        self.camera.pos = self.collisionBox.position + (self.collisionBox.dimensions / 2)
-        self.camera.pos.y = self.collisionBox.position.y + PLAYER_HEIGHT
+        if boxPosition is None:
+            boxPosition = self.collisionBox.position
+        self.camera.pos = boxPosition + (self.collisionBox.dimensions / 2)
+        self.camera.pos.y = boxPosition.y + PLAYER_HEIGHT
 
     def DrawDebug(self, shader):
         self.collisionBox.DrawDebug(shader)
         self.physBox.DrawDebug(shader)
 
-        for box in self.CurrentBlockBoxes:
-            box.DrawDebug(shader)
-
@@ -1,53 +1,129 @@
-# A scope based class that gets the amount of time something took to execute
+# Profiling
+# Named zones time parts of the code, either with a "with zone(name):" block or with the @profile(name) decorator.
+# The samples of the last PROFILE_FRAMES frames are kept in a ring buffer, they can be summarized (count, mean, p95, max)
+# or exported as a Chrome trace (open it in chrome://tracing or https://ui.perfetto.dev).
+#
+# Profiling is off unless the FALAFEL_PROFILE environment variable is set (to anything other than 0), it can also be
+# switched at runtime with setProfilingEnabled(). When it's off a zone is a shared object that does nothing, so the
+# instrumentation costs about as much as a function call.
+import functools
+import json
+import os
+import threading
 import time
+from collections import deque
 
-DO_FUNCTION_PROFILING = False
-DO_SCOPE_PROFILING = False
+PROFILE_ENV_VAR = "FALAFEL_PROFILE"
+PROFILE_FRAMES = 300 # How many frames of samples are kept
+PROFILE_TRACE_FILE = "profile_trace.json"
 
-if DO_FUNCTION_PROFILING:
+# A timed section of code, records itself into the profiler when it exits
+class Zone:
+    __slots__ = ("profiler", "name", "start")
 
-    class Timer:
-        def __init__(self, name : str):
-            self.mName = name
-            self.mStartTime = time.perf_counter() * 1000.0 # Get milliseconds
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
 
-            print("%s Starting..." %self.mName)
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
 
-        def __del__(self):
-            endTime = time.perf_counter() * 1000.0 # Get Milliseconds
+    def __exit__(self, *exception):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
 
-            duration = endTime - self.mStartTime
+# What zone() gives back while profiling is off
+class NullZone:
+    __slots__ = ()
 
-            print("%s took %sms" %(self.mName, duration))
+    def __enter__(self):
+        return self
 
-else:
+    def __exit__(self, *exception):
+        return False
 
-    class Timer:
-        def __init__(self, dummyParam):
-            """
-            DO nothing!
-            We don't always want profiling and optimizations will delete this
-            """
+NULL_ZONE = NullZone()
 
-if DO_SCOPE_PROFILING:
-    class ScopeTimer:
-        def __init__(self, name : str):
-            self.mName = name
-            self.mStartTime = time.perf_counter() * 1000.0 # Get milliseconds
+class Profiler:
+    def __init__(self, enabled = False, maxFrames = PROFILE_FRAMES):
+        self.enabled = enabled
+        self.frames = deque(maxlen=maxFrames) # (frame start, frame end, samples) of the last frames, oldest first
+        self.samples = list() # (name, start, end, thread) of the frame that's going on, times are in nanoseconds
+        self.frameStart = time.perf_counter_ns()
 
-            print("%s Scope Starting..." %self.mName)
+    def zone(self, name):
+        return Zone(self, name) if self.enabled else NULL_ZONE
 
-        def __del__(self):
-            endTime = time.perf_counter() * 1000.0 # Get Milliseconds
+    def record(self, name, start, end):
+        self.samples.append((name, start, end, threading.get_ident()))
 
-            duration = endTime - self.mStartTime
+    # Close the current frame (call once per frame) and start the next one
+    def endFrame(self):
+        if not self.enabled:
+            return
+        now = time.perf_counter_ns()
+        self.frames.append((self.frameStart, now, self.samples))
+        self.samples = list()
+        self.frameStart = now
 
-            print("%s took %sms" %(self.mName, duration))
+    def clear(self):
+        self.frames.clear()
+        self.samples = list()
 
-else:
-    class ScopeTimer:
-        def __init__(self, dummyParam):
-            """
-            DO nothing!
-            We don't always want profiling and optimizations will delete this
-            """
\ No newline at end of file
+    # Get count, mean, p95 and max (in milliseconds) of each zone over the buffered frames
+    def getStats(self):
+        durations = dict()
+        for frameStart, frameEnd, samples in self.frames:
+            for name, start, end, thread in samples:
+                durations.setdefault(name, list()).append((end - start) / 1e6)
+        stats = dict()
+        for name, times in durations.items():
+            times.sort()
+            stats[name] = {
+                "count": len(times),
+                "mean": sum(times) / len(times),
+                "p95": times[int(0.95 * (len(times) - 1))],
+                "max": times[-1],
+            }
+        return stats
+
+    def printStats(self):
+        stats = self.getStats()
+        print("%-60s %8s %10s %10s %10s" % ("Zone (over %d frames)" % len(self.frames), "count", "mean ms", "p95 ms", "max ms"))
+        for name, s in sorted(stats.items(), key=lambda item: item[1]["mean"] * item[1]["count"], reverse=True):
+            print("%-60s %8d %10.3f %10.3f %10.3f" % (name[:60], s["count"], s["mean"], s["p95"], s["max"]))
+
+    # Write the buffered frames in the Chrome trace event format
+    def exportChromeTrace(self, path = PROFILE_TRACE_FILE):
+        events = list()
+        pid = os.getpid()
+        for frameStart, frameEnd, samples in self.frames:
+            events.append({"name": "Frame", "ph": "X", "ts": frameStart / 1000, "dur": (frameEnd - frameStart) / 1000,
+                           "pid": pid, "tid": 0})
+            for name, start, end, thread in samples:
+                events.append({"name": name, "ph": "X", "ts": start / 1000, "dur": (end - start) / 1000,
+                               "pid": pid, "tid": thread})
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+profiler = Profiler(os.environ.get(PROFILE_ENV_VAR, "0") not in ("", "0"))
+
+def setProfilingEnabled(enabled):
+    profiler.enabled = enabled
+
+# Time a block of code: with zone("World.Draw"): ...
+def zone(name):
+    return profiler.zone(name)
+
+# Time every call of a function: @profile("World.Draw")
+def profile(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            with Zone(profiler, name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,152 @@
+# Imports
+# Default
+import math
+# Other
+import numpy as np
+# Project Files
+from block import AIR
+from profiling import *
+
+from settings import CHUNK_SIZE, CHUNK_HEIGHT, MAX_INTERACTION_DIST
+
+# Voxel ray casting (Amanatides and Woo's grid traversal)
+# A ray visits every block it passes through exactly once, in order, by always stepping across whichever block boundary
+# (x, y or z) it reaches first. The blocks come from the world's loaded chunks, unloaded chunks count as air.
+
+# What a ray hit
+#     hit: whether it hit a block before maxDistance
+#     position: the block it hit
+#     normal: the face of that block that the ray went through, (0, 0, 0) if the ray started inside the block
+#     placePosition: the block in front of that face, where a block placed on the hit face goes
+#     distance: how far along the ray the hit is
+class RayHit:
+    __slots__ = ("hit", "position", "normal", "placePosition", "distance")
+
+    def __init__(self, hit, position = None, normal = None, distance = math.inf):
+        self.hit = hit
+        self.position = position
+        self.normal = normal
+        self.placePosition = None if position is None else (position[0] + normal[0], position[1] + normal[1], position[2] + normal[2])
+        self.distance = distance
+
+NO_HIT = RayHit(False)
+
+# Get the distance along a ray to the first block boundary on one axis and the distance between boundaries
+def getAxisSteps(origin, direction, cell):
+    if direction > 0:
+        return (cell + 1 - origin) / direction, 1 / direction
+    if direction < 0:
+        return (cell - origin) / direction, -1 / direction
+    return math.inf, math.inf
+
+# Cast a ray through the world's blocks, returns a RayHit for the first block that isn't air
+@profile("rayCast(World, vec3, vec3, float)")
+def rayCast(world, origin, direction, maxDistance = MAX_INTERACTION_DIST):
+    dx, dy, dz = float(direction[0]), float(direction[1]), float(direction[2])
+    length = math.sqrt(dx * dx + dy * dy + dz * dz)
+    if length == 0:
+        return NO_HIT
+    dx, dy, dz = dx / length, dy / length, dz / length
+    ox, oy, oz = float(origin[0]), float(origin[1]), float(origin[2])
+
+    x, y, z = math.floor(ox), math.floor(oy), math.floor(oz)
+    stepX, stepY, stepZ = (dx > 0) - (dx < 0), (dy > 0) - (dy < 0), (dz > 0) - (dz < 0)
+    tMaxX, tDeltaX = getAxisSteps(ox, dx, x)
+    tMaxY, tDeltaY = getAxisSteps(oy, dy, y)
+    tMaxZ, tDeltaZ = getAxisSteps(oz, dz, z)
+
+    normal = (0, 0, 0)
+    distance = 0.0
+    chunkKey = None; blocks = None
+    while distance <= maxDistance:
+        # Look the block up in its chunk (only fetching the chunk when the ray moves into a new one)
+        if 0 <= y < CHUNK_HEIGHT:
+            key = (x // CHUNK_SIZE, z // CHUNK_SIZE)
+            if key != chunkKey:
+                chunkKey = key
+                blocks = world.getChunkBlocks(key)
+            if blocks is not None and blocks[x - key[0] * CHUNK_SIZE, y, z - key[1] * CHUNK_SIZE] != AIR:
+                return RayHit(True, (x, y, z), normal, distance)
+        elif (y < 0 and stepY <= 0) or (y >= CHUNK_HEIGHT and stepY >= 0):
+            break # Out of the world and not coming back
+
+        # Step into the next block (ties go to x, then y, like rayCastMany())
+        if tMaxX <= tMaxY and tMaxX <= tMaxZ:
+            x += stepX; distance = tMaxX; tMaxX += tDeltaX; normal = (-stepX, 0, 0)
+        elif tMaxY <= tMaxZ:
+            y += stepY; distance = tMaxY; tMaxY += tDeltaY; normal = (0, -stepY, 0)
+        else:
+            z += stepZ; distance = tMaxZ; tMaxZ += tDeltaZ; normal = (0, 0, -stepZ)
+    return NO_HIT
+
+# Copy the blocks of a rectangle of chunks (from minChunk to maxChunk, inclusive) into one array, AIR where a chunk isn't
+# loaded, returns the array and the world position of its (0, 0, 0) block
+def gatherBlocks(world, minChunk, maxChunk):
+    blocks = np.zeros(((maxChunk[0] - minChunk[0] + 1) * CHUNK_SIZE, CHUNK_HEIGHT, (maxChunk[1] - minChunk[1] + 1) * CHUNK_SIZE),
+                      dtype=np.uint8)
+    for cx in range(minChunk[0], maxChunk[0] + 1):
+        for cz in range(minChunk[1], maxChunk[1] + 1):
+            chunkBlocks = world.getChunkBlocks((cx, cz))
+            if chunkBlocks is not None:
+                x, z = (cx - minChunk[0]) * CHUNK_SIZE, (cz - minChunk[1]) * CHUNK_SIZE
+                blocks[x:x + CHUNK_SIZE, :, z:z + CHUNK_SIZE] = chunkBlocks
+    return blocks, np.array([minChunk[0] * CHUNK_SIZE, 0, minChunk[1] * CHUNK_SIZE])
+
+# Cast a lot of rays at once (for things like explosions and line of sight checks), origins and directions are (N, 3)
+# Every ray takes one step per iteration, so the Python work depends on the longest ray instead of the number of rays
+# Returns arrays of hit (N), position (N, 3), normal (N, 3) and distance (N, inf where nothing was hit), with the same
+# meanings as RayHit
+@profile("rayCastMany(World, ndarray, ndarray, float)")
+def rayCastMany(world, origins, directions, maxDistance = MAX_INTERACTION_DIST):
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 3)
+    directions = np.asarray(directions, dtype=np.float64).reshape(-1, 3)
+    n = len(origins)
+    lengths = np.linalg.norm(directions, axis=1)
+    directions = directions / np.where(lengths > 0, lengths, 1)[:, None]
+
+    cells = np.floor(origins).astype(np.int64)
+    steps = np.sign(directions).astype(np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        tDelta = np.where(steps != 0, 1 / np.abs(directions), np.inf)
+        tMax = np.where(steps > 0, (cells + 1 - origins) / directions,
+                        np.where(steps < 0, (cells - origins) / directions, np.inf))
+
+    hit = np.zeros(n, dtype=bool)
+    positions = np.zeros((n, 3), dtype=np.int64)
+    normals = np.zeros((n, 3), dtype=np.int64)
+    distances = np.full(n, np.inf)
+    if n == 0:
+        return hit, positions, normals, distances
+
+    # Every block the rays can reach, in one array (the rays can't leave it before maxDistance)
+    reachMin = np.floor(origins.min(axis=0) - maxDistance - 1).astype(np.int64) // CHUNK_SIZE
+    reachMax = np.floor(origins.max(axis=0) + maxDistance + 1).astype(np.int64) // CHUNK_SIZE
+    blocks, blocksOrigin = gatherBlocks(world, (reachMin[0], reachMin[2]), (reachMax[0], reachMax[2]))
+    cells -= blocksOrigin
+
+    distance = np.zeros(n)
+    normal = np.zeros((n, 3), dtype=np.int64)
+    active = np.flatnonzero(lengths > 0)
+    while len(active) > 0:
+        # Check the blocks the active rays are in
+        activeCells = cells[active]
+        inside = (activeCells[:, 1] >= 0) & (activeCells[:, 1] < CHUNK_HEIGHT)
+        solid = np.zeros(len(active), dtype=bool)
+        solid[inside] = blocks[activeCells[inside, 0], activeCells[inside, 1], activeCells[inside, 2]] != AIR
+        done = active[solid]
+        hit[done] = True; positions[done] = cells[done] + blocksOrigin; normals[done] = normal[done]; distances[done] = distance[done]
+        active = active[~solid]
+
+        # Step each ray across its closest boundary
+        axis = np.argmin(tMax[active], axis=1)
+        distance[active] = tMax[active, axis]
+        cells[active, axis] += steps[active, axis]
+        tMax[active, axis] += tDelta[active, axis]
+        normal[active] = 0
+        normal[active, axis] = -steps[active, axis]
+
+        # Drop the rays that went too far or left the world for good
+        y = cells[active, 1]
+        leaving = ((y < 0) & (steps[active, 1] <= 0)) | ((y >= CHUNK_HEIGHT) & (steps[active, 1] >= 0))
+        active = active[(distance[active] <= maxDistance) & ~leaving]
+    return hit, positions, normals, distances
@@ -0,0 +1,183 @@
+# Imports
+# Default
+import os
+import struct
+import threading
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+# Other
+import numpy as np
+# Project Files
+from profiling import *
+
+from settings import CHUNK_SIZE, CHUNK_HEIGHT, REGION_SIZE
+
+# Region file layout:
+#     magic and version (8 bytes)
+#     header with an (offset, length) entry for each of the REGION_SIZE x REGION_SIZE chunks, a length of 0 means the
+#     chunk hasn't been saved
+#     zlib compressed block arrays, a chunk that gets saved again is appended and its header entry is pointed at the new
+#     copy (entries are only changed after their data is written, so a header entry always points at a complete chunk)
+REGION_MAGIC = b"FCRG"
+REGION_VERSION = 1
+HEADER_ENTRY = struct.Struct("<QI") # Offset, length
+HEADER_START = 8
+HEADER_SIZE = HEADER_START + HEADER_ENTRY.size * REGION_SIZE * REGION_SIZE
+COMPRESSION_LEVEL = 1 # Block arrays are mostly long runs of the same id, so fast compression does almost as well
+
+CHUNK_SHAPE = (CHUNK_SIZE, CHUNK_HEIGHT, CHUNK_SIZE)
+
+class RegionError(Exception):
+    pass
+
+# Get the region a chunk is in and the chunk's index in the region's header
+def toRegionPos(chunkX, chunkY):
+    return (chunkX // REGION_SIZE, chunkY // REGION_SIZE), (chunkX % REGION_SIZE) + (chunkY % REGION_SIZE) * REGION_SIZE
+
+# Saves chunks' blocks into region files of REGION_SIZE x REGION_SIZE chunks
+class RegionStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.headers = dict() # Region position -> list of (offset, length), read from the files when first needed
+        self.lock = threading.Lock() # Reads happen on the main thread while saveAsync() writes on the writer thread
+        self.writer = ThreadPoolExecutor(max_workers=1) # One thread so writes to a file never interleave
+
+    def getRegionPath(self, regionPos):
+        return os.path.join(self.directory, "r.%d.%d.region" % regionPos)
+
+    # Get a region's header, reading it from its file (or creating the file) the first time
+    def getHeader(self, regionPos):
+        header = self.headers.get(regionPos)
+        if header is None:
+            path = self.getRegionPath(regionPos)
+            if not os.path.exists(path):
+                with open(path, "wb") as file:
+                    file.write(REGION_MAGIC + struct.pack("<I", REGION_VERSION) + bytes(HEADER_SIZE - HEADER_START))
+            with open(path, "rb") as file:
+                data = file.read(HEADER_SIZE)
+            if data[:4] != REGION_MAGIC or struct.unpack_from("<I", data, 4)[0] != REGION_VERSION:
+                raise RegionError("%s isn't a version %d region file" % (path, REGION_VERSION))
+            header = [HEADER_ENTRY.unpack_from(data, HEADER_START + i * HEADER_ENTRY.size) for i in range(REGION_SIZE * REGION_SIZE)]
+            self.headers[regionPos] = header
+        return header
+
+    # Check if a chunk has been saved
+    def has(self, chunkX, chunkY):
+        regionPos, index = toRegionPos(chunkX, chunkY)
+        with self.lock:
+            return self.getHeader(regionPos)[index][1] > 0
+
+    # Read a chunk's blocks (None if it hasn't been saved)
+    @profile("RegionStore.load(int, int)")
+    def load(self, chunkX, chunkY):
+        regionPos, index = toRegionPos(chunkX, chunkY)
+        with self.lock:
+            offset, length = self.getHeader(regionPos)[index]
+            if length == 0:
+                return None
+            with open(self.getRegionPath(regionPos), "rb") as file:
+                file.seek(offset)
+                data = file.read(length)
+        return np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(CHUNK_SHAPE).copy()
+
+    # Write a chunk's blocks
+    @profile("RegionStore.save(int, int, ndarray)")
+    def save(self, chunkX, chunkY, blocks):
+        data = zlib.compress(np.ascontiguousarray(blocks).tobytes(), COMPRESSION_LEVEL)
+        regionPos, index = toRegionPos(chunkX, chunkY)
+        with self.lock:
+            header = self.getHeader(regionPos)
+            with open(self.getRegionPath(regionPos), "r+b") as file:
+                # Data first, then the header entry that points at it
+                offset = file.seek(0, os.SEEK_END)
+                file.write(data)
+                file.flush()
+                file.seek(HEADER_START + index * HEADER_ENTRY.size)
+                file.write(HEADER_ENTRY.pack(offset, len(data)))
+            header[index] = (offset, len(data))
+
+    # Region files are compressed, so chunks keep their own arrays
+    def attach(self, chunkX, chunkY, blocks):
+        return blocks
+
+    # Write a chunk's blocks on the writer thread (a copy is saved, so the chunk can keep changing)
+    def saveAsync(self, chunkX, chunkY, blocks):
+        return self.writer.submit(self.save, chunkX, chunkY, blocks.copy())
+
+    # Wait for the writes that are still queued
+    def close(self):
+        self.writer.shutdown(wait=True)
+
+# Mapped file layout:
+#     magic and version (8 bytes), then a byte for each of the REGION_SIZE x REGION_SIZE chunks that's 1 once it's saved
+#     (padded to a page)
+#     a fixed size slot with the raw block array of each chunk
+MAPPED_MAGIC = b"FCMP"
+MAPPED_VERSION = 1
+MAPPED_HEADER_SIZE = 4096
+SLOT_SIZE = CHUNK_SIZE * CHUNK_HEIGHT * CHUNK_SIZE
+
+# Keeps chunks' blocks in memory-mapped files, the blocks of a loaded chunk are a view of its slot, so loading is only a
+# page-in, edits are written back by the OS and what stays in RAM is up to the page cache
+class MappedChunkStore:
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+        self.regions = dict() # Region position -> (saved flags, slots), both views of the file's memmap
+
+    def getRegionPath(self, regionPos):
+        return os.path.join(self.directory, "r.%d.%d.chunks" % regionPos)
+
+    # Map a region's file (creating it the first time, untouched slots don't take up disk space on most file systems)
+    def getRegion(self, regionPos):
+        region = self.regions.get(regionPos)
+        if region is None:
+            path = self.getRegionPath(regionPos)
+            numChunks = REGION_SIZE * REGION_SIZE
+            if not os.path.exists(path):
+                with open(path, "wb") as file:
+                    file.write(MAPPED_MAGIC + struct.pack("<I", MAPPED_VERSION))
+                    file.truncate(MAPPED_HEADER_SIZE + numChunks * SLOT_SIZE)
+            data = np.memmap(path, dtype=np.uint8, mode="r+")
+            if bytes(data[:4]) != MAPPED_MAGIC or struct.unpack("<I", bytes(data[4:8]))[0] != MAPPED_VERSION:
+                raise RegionError("%s isn't a version %d mapped chunk file" % (path, MAPPED_VERSION))
+            region = (data[8:8 + numChunks], data[MAPPED_HEADER_SIZE:].reshape((numChunks, *CHUNK_SHAPE)))
+            self.regions[regionPos] = region
+        return region
+
+    def has(self, chunkX, chunkY):
+        regionPos, index = toRegionPos(chunkX, chunkY)
+        return self.getRegion(regionPos)[0][index] == 1
+
+    # Get a view of a chunk's slot (None if it hasn't been saved)
+    def load(self, chunkX, chunkY):
+        regionPos, index = toRegionPos(chunkX, chunkY)
+        saved, slots = self.getRegion(regionPos)
+        return slots[index] if saved[index] == 1 else None
+
+    # Put a chunk's blocks into its slot and get the slot's view (which the chunk should use from then on)
+    def attach(self, chunkX, chunkY, blocks):
+        regionPos, index = toRegionPos(chunkX, chunkY)
+        saved, slots = self.getRegion(regionPos)
+        if not np.shares_memory(blocks, slots[index]):
+            slots[index] = blocks
+        saved[index] = 1
+        return slots[index]
+
+    def save(self, chunkX, chunkY, blocks):
+        self.attach(chunkX, chunkY, blocks)
+
+    # Copying into the slot is as cheap as queueing the copy, the OS does the actual writing
+    def saveAsync(self, chunkX, chunkY, blocks):
+        self.save(chunkX, chunkY, blocks)
+
+    def close(self):
+        for saved, slots in self.regions.values():
+            slots.flush()
+        self.regions.clear()
+
+# Chunk storage modes (settings.CHUNK_STORAGE)
+chunkStores = {"region": RegionStore, "mapped": MappedChunkStore}
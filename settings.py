@@ -1,12 +1,15 @@
 import glm
 import math
+import os
 # Chunk size and max height
 CHUNK_SIZE = 16 # X by Y size of each chunk
 MAX_HEIGHT = 128
+CHUNK_HEIGHT = 256 # The vertical size of a chunk's block storage (terrain can go above MAX_HEIGHT)
 
 # Vertex Data Config
 FLOATS_PER_VERTEX = 6
 FLOATS_PER_DEBUG_VERTEX = 6
+UINTS_PER_PACKED_VERTEX = 2 # Chunk meshes (see mesh.packChunkVertex)
 VERTS_PER_BLOCK = 24 # TODO: Optimize so that we only need 8
 INDICES_PER_FACE = 6
 
@@ -16,8 +19,32 @@ NOISE_OCTAVES = 8
 WATER_LEVEL = 32 # the height that water generates at
 MAX_GEN_HEIGHT = 64 # the height that water generates at
 
+# Chunk streaming
+CHUNK_WORKERS = max(1, (os.cpu_count() or 2) - 1) # Worker processes for chunk generation (one core is left for rendering)
+CHUNK_UPLOADS_PER_FRAME = 2 # How many finished chunks get their mesh uploaded each frame
+CHUNK_BORDER_REMESHES_PER_FRAME = 2 # How many chunks get their borders fixed each frame (after a neighbor loaded)
+CHUNK_UNLOAD_MARGIN = 2 # Chunks get unloaded once they're this many chunks past the load distance
+CHUNK_CACHE_BYTES = 64 * 1024 * 1024 # Memory for keeping recently unloaded chunks around
+NOISE_CONTEXT_CACHE_SIZE = 4 # How many seeds keep their noise generators alive
+
+# Saving
+SAVE_DIRECTORY = "saves" # Each seed gets a folder in here
+LEVEL_FILE = "level.json" # The seed of the world that gets opened on startup (in SAVE_DIRECTORY)
+REGION_SIZE = 8 # Region files hold REGION_SIZE x REGION_SIZE chunks
+CHUNK_STORAGE = "region" # "region" (compressed files) or "mapped" (memory-mapped files with a fixed size slot per chunk)
+
 # Graphics
 AO_CLIPPING_STRENGTH = 0.125
+RENDER_DISTANCE = 256 # Chunks further away than this (horizontally, in blocks) don't get drawn
+FRAME_BUDGET_MS = 1000 / 60 # Frames that take longer than this count as hitches
+CHUNK_ARENA_PAGE_VERTICES = 1024 # Chunk meshes get vertex buffer space in pages of this many vertices (see arena.py)
+CHUNK_ARENA_INITIAL_PAGES = 2048 # 16 MB, the arena doubles when it runs out
+GREEDY_MESHING = False # Merge neighboring faces that look the same into bigger quads (edits rebuild the whole chunk)
+
+# Telemetry (see telemetry.py)
+TELEMETRY_FRAMES = 240 # How many frames the overlay graph shows
+TELEMETRY_TITLE_INTERVAL = 0.5 # How often the numbers in the window title get updated (in seconds)
+SHOW_TELEMETRY = False # Start with the overlay on (F3 toggles it)
 
 # Physics stuff
 GRAVITY = glm.vec3(0.0, -19.62, 0.0) # This is 2 times the strength of real gravity, but it feels nicer.
@@ -32,10 +59,10 @@ PLAYER_HEIGHT = 1.7 # Average height of a man in meters
 MOVEMENT_SPEED = 1.0
 SPRINT_SPEED = 1.5
 DAY_MINUTES = 1
-TICKS_PER_SECOND = 16
+TICKS_PER_SECOND = 16 # Fixed simulation rate, rendering runs at its own rate and interpolates between ticks
+MAX_TICKS_PER_FRAME = 5 # Catch-up cap, after a longer hitch than this many ticks the simulation drops the time instead
+VSYNC = False # Rendering doesn't need to be capped, the simulation doesn't depend on the frame rate
 FoV = 90
 
 # Ray casting and interaction stuff
 MAX_INTERACTION_DIST = 32 # in blocks
-STEPS_PER_RAY_UNIT = 8 # How many steps it'll take to move the space of a block
-RAY_CAST_REFINES = 8 # DON'T PUT BELOW 4!!!
@@ -1,13 +1,16 @@
 # Imports
 from OpenGL.GL import *
+import glm
+import struct
+from ctypes import string_at
 
 # Profiling
 from profiling import *
+from telemetry import frameCounters
 
 # Compile shader
+@profile("ShaderProgram.compileShader(str, GLenum)")
 def compileShader(shaderCode, shaderType):
-    t = Timer("    ShaderProgram.compileShader(str, GLenum)")
-
     # Create the shader
     shader = glCreateShader(shaderType)
     # Set shader code from source
@@ -22,69 +25,138 @@ def compileShader(shaderCode, shaderType):
     # Return
     return shader
 
-# Cast matrix to array of GLfloats
+# Get a pointer to a matrix's GLfloats (column major, like OpenGL wants them) without copying them
 def castMatrix(matrix):
-    m = [y for x in matrix for y in x]
-    r = (GLfloat * len(m))(*m)
-    return r
+    return glm.value_ptr(matrix)
+
+# Get the bytes of a glm vector or matrix (in the same order as castMatrix())
+def toBytes(value):
+    return string_at(glm.value_ptr(value), glm.sizeof(type(value)))
+
+# Per frame camera and time of day data that every shader reads from the CameraData uniform block (see
+# shader_data.cameraBlockCode), std140 layout:
+#     mat4 projectionMatrix, mat4 viewMatrix, mat4 skyViewMatrix, vec4 cameraPos, float time, float sunHeight
+CAMERA_BLOCK_NAME = "CameraData"
+CAMERA_BLOCK_BINDING = 0
+CAMERA_BLOCK_SIZE = 3 * 64 + 16 + 16 # The last 16 bytes are time, sunHeight and padding
+
+class UniformBuffer:
+    def __init__(self, size, binding):
+        self.size = size
+        self.UBO = GLuint(0)
+        glGenBuffers(1, self.UBO)
+        glBindBuffer(GL_UNIFORM_BUFFER, self.UBO)
+        glBufferData(GL_UNIFORM_BUFFER, size, None, GL_DYNAMIC_DRAW)
+        # Programs read the block from the binding point, so this is the only binding it needs
+        glBindBufferBase(GL_UNIFORM_BUFFER, binding, self.UBO)
+        glBindBuffer(GL_UNIFORM_BUFFER, 0)
+
+    # Replace the buffer's contents (data has to be self.size bytes)
+    def update(self, data):
+        glBindBuffer(GL_UNIFORM_BUFFER, self.UBO)
+        glBufferSubData(GL_UNIFORM_BUFFER, 0, self.size, data)
+        frameCounters.glCalls += 2
+
+class CameraUniformBuffer(UniformBuffer):
+    def __init__(self):
+        super().__init__(CAMERA_BLOCK_SIZE, CAMERA_BLOCK_BINDING)
+
+    @profile("CameraUniformBuffer.set(mat4, mat4, mat4, vec3, float, float)")
+    def set(self, projectionMatrix, viewMatrix, skyViewMatrix, cameraPos, time, sunHeight):
+        self.update(toBytes(projectionMatrix) + toBytes(viewMatrix) + toBytes(skyViewMatrix) +
+                    toBytes(glm.vec4(cameraPos, 1.0)) + struct.pack("<4f", time, sunHeight, 0.0, 0.0))
 
 class ShaderProgram:
+    @profile("ShaderProgram.__init__()")
     def __init__(self, vertexSource, fragmentSource):
-        t = Timer("ShaderProgram.__init__()")
-
         # Compile the vertex and fragment shaders
         self.vertex = compileShader(vertexSource.encode(), GL_VERTEX_SHADER)
         self.fragment = compileShader(fragmentSource.encode(), GL_FRAGMENT_SHADER)
         # Setup the program
-        CompleteShaderSetup = Timer("    ShaderProgram.__init__::Linking Shaders")
-        self.ID = glCreateProgram()
-        # Attach shaders
-        glAttachShader(self.ID, self.vertex) # Vertex shader
-        glAttachShader(self.ID, self.fragment) # Fragment shader
-        # Link the program to finalize the setup
-        glLinkProgram(self.ID)
-        # Error check
-        if (not glGetProgramiv(self.ID, GL_LINK_STATUS)):
-            print("ERROR::PROGRAM_LINKING_ERROR: ")
-            print(glGetProgramInfoLog(self.ID))
-        del CompleteShaderSetup
+        with zone("ShaderProgram.__init__::Linking Shaders"):
+            self.ID = glCreateProgram()
+            # Attach shaders
+            glAttachShader(self.ID, self.vertex) # Vertex shader
+            glAttachShader(self.ID, self.fragment) # Fragment shader
+            # Link the program to finalize the setup
+            glLinkProgram(self.ID)
+            # Error check
+            if (not glGetProgramiv(self.ID, GL_LINK_STATUS)):
+                print("ERROR::PROGRAM_LINKING_ERROR: ")
+                print(glGetProgramInfoLog(self.ID))
+            # Look up the uniform locations once instead of on every set call
+            self.uniformLocations = self.getActiveUniforms()
+            # Read the camera block from its shared buffer (if the program uses it)
+            blockIndex = glGetUniformBlockIndex(self.ID, CAMERA_BLOCK_NAME.encode())
+            if blockIndex != GL_INVALID_INDEX:
+                glUniformBlockBinding(self.ID, blockIndex, CAMERA_BLOCK_BINDING)
+
+    # Get the location of every active uniform by name (uniforms in blocks don't have one and are left out)
+    def getActiveUniforms(self):
+        locations = dict()
+        for i in range(glGetProgramiv(self.ID, GL_ACTIVE_UNIFORMS)):
+            name = glGetActiveUniform(self.ID, i)[0]
+            name = name.decode() if isinstance(name, bytes) else str(name)
+            if name.endswith("[0]"): # Arrays are listed by their first element
+                name = name[:-3]
+            location = glGetUniformLocation(self.ID, name.encode())
+            if location != -1:
+                locations[name] = location
+        return locations
+
+    # Get a uniform's location (-1 for names that the program doesn't have, setting those does nothing)
+    def getUniformLocation(self, name):
+        location = self.uniformLocations.get(name)
+        if location is None:
+            location = glGetUniformLocation(self.ID, name.encode())
+            self.uniformLocations[name] = location
+        return location
 
     # Use/Unuse shader function
     def use(self):
         glUseProgram(self.ID)
+        frameCounters.glCalls += 1
 
     def unUse(self):
         glUseProgram(0)
+        frameCounters.glCalls += 1
 
     # Uniform setting (sends data to the shader each frame for render settings)
     # Scalars
     # Integer
     def setInt(self, name, value):
-        location = glGetUniformLocation(self.ID, name.encode())
-        glUniform1i(location, value)
+        glUniform1i(self.getUniformLocation(name), value)
+        frameCounters.glCalls += 1
     # Boolean
     def setBool(self, name, value):
-        glUniform1i(glGetUniformLocation(self.ID, name.encode()), int(value))
+        glUniform1i(self.getUniformLocation(name), int(value))
+        frameCounters.glCalls += 1
     # Float
     def setFloat(self, name, value):
-        glUniform1f(glGetUniformLocation(self.ID, name.encode()), value)
+        glUniform1f(self.getUniformLocation(name), value)
+        frameCounters.glCalls += 1
     # Vectors
     # 2 component vector
     def setVec2(self, name, vec):
-        glUniform2f(glGetUniformLocation(self.ID, name.encode()), vec.x, vec.y)
+        glUniform2f(self.getUniformLocation(name), vec.x, vec.y)
+        frameCounters.glCalls += 1
     # 3 component vector
     def setVec3(self, name, vec):
-        glUniform3f(glGetUniformLocation(self.ID, name.encode()), vec.x, vec.y, vec.z)
+        glUniform3f(self.getUniformLocation(name), vec.x, vec.y, vec.z)
+        frameCounters.glCalls += 1
     # 4 component vector
     def setVec4(self, name, vec):
-        glUniform4f(glGetUniformLocation(self.ID, name.encode()), vec.x, vec.y, vec.z, vec.w)
+        glUniform4f(self.getUniformLocation(name), vec.x, vec.y, vec.z, vec.w)
+        frameCounters.glCalls += 1
     # Matrices
     # 3x3 matrix
     def setMat3(self, name, mat):
-        glUniformMatrix3fv(glGetUniformLocation(self.ID, name.encode()), 1, GL_FALSE, castMatrix(mat))
+        glUniformMatrix3fv(self.getUniformLocation(name), 1, GL_FALSE, castMatrix(mat))
+        frameCounters.glCalls += 1
     # 4x4 matrix
     def setMat4(self, name, mat):
-        glUniformMatrix4fv(glGetUniformLocation(self.ID, name.encode()), 1, GL_FALSE, castMatrix(mat))
+        glUniformMatrix4fv(self.getUniformLocation(name), 1, GL_FALSE, castMatrix(mat))
+        frameCounters.glCalls += 1
     # Texture 2D
     def setTexture2D(self, name, texID, index):
         # Set active texture
@@ -1,14 +1,26 @@
 # Literally just shader strings so that the main file isn't so cluttered
 
-vertexCode = """#version 330 core
+# Camera and time of day, shared by every shader that includes it (filled once per frame by
+# shader.CameraUniformBuffer, the layout has to match it)
+cameraBlockCode = """
+layout(std140) uniform CameraData
+{
+    mat4 projectionMatrix;
+    mat4 viewMatrix;
+    mat4 skyViewMatrix; // viewMatrix without the translation (for the sky)
+    vec4 cameraPos;
+    float time;
+    float sunHeight;
+};
+"""
+
+vertexCode = """#version 330 core""" + cameraBlockCode + """
 layout(location = 0) in vec3 aPos;
 layout(location = 1) in float aBrightness;
 layout(location = 2) in vec2 aTexCoords;
 
 // Uniforms
 uniform mat4 modelMatrix;
-uniform mat4 projectionMatrix;
-uniform mat4 viewMatrix;
 
 // Output
 out vec3 FragPos;
@@ -22,6 +34,44 @@ void main()
     Brightness = aBrightness;
     // TexCoords
     TexCoords = aTexCoords.xy;
+    gl_Position = projectionMatrix * skyViewMatrix * vec4(FragPos, 1.0);
+}
+"""
+
+################################
+# Chunk Shader                 #
+################################
+# Vertex Shader for packed chunk vertices (see mesh.packChunkVertex) drawn from the chunk arena (see arena.py)
+chunkVertexCode = """#version 330 core""" + cameraBlockCode + """
+layout(location = 0) in uvec2 aPacked;
+
+// Uniforms
+// Chunk origin (x, z) of each page of the arena, gl_VertexID includes the chunk's base vertex so it finds the page
+uniform isamplerBuffer uChunkOrigins;
+uniform int uArenaPageVertices;
+
+uniform float uAOStrength = 0.125;
+
+// Output
+out vec3 FragPos;
+out float Brightness;
+out vec2 TexCoords;
+
+// TexCoords are tile * TILE_SPAN + position in the tile, so that the fragment shader can repeat the tile
+const float TILE_SPAN = 512.0;
+
+void main()
+{
+    // Unpack position (chunk local) and ambient occlusion
+    vec3 pos = vec3(float(aPacked.x & 31u), float((aPacked.x >> 5) & 511u), float((aPacked.x >> 14) & 31u));
+    Brightness = 1.0 - float((aPacked.x >> 19) & 3u) * uAOStrength;
+    // Unpack the texture tile and coordinates
+    vec2 tile = vec2(float(aPacked.y & 15u), float((aPacked.y >> 4) & 15u));
+    vec2 local = vec2(float((aPacked.y >> 8) & 511u), float((aPacked.y >> 17) & 511u));
+    TexCoords = tile * TILE_SPAN + local;
+    // FragPos
+    ivec2 origin = texelFetch(uChunkOrigins, gl_VertexID / uArenaPageVertices).xy;
+    FragPos = pos + vec3(float(origin.x), 0.0, float(origin.y));
     gl_Position = projectionMatrix * viewMatrix * vec4(FragPos, 1.0);
 }
 """
@@ -30,15 +80,13 @@ void main()
 # Debug Shader                 #
 ################################
 # Vertex Shader
-debugVertexCode = """#version 330 core
+debugVertexCode = """#version 330 core""" + cameraBlockCode + """
 layout(location = 0) in vec3 aPos;
 layout(location = 1) in vec3 aColor;
 
 out vec3 Color;
 
 uniform mat4 modelMatrix;
-uniform mat4 projectionMatrix;
-uniform mat4 viewMatrix;
 
 void main() {
     Color = aColor.rgb;
@@ -61,15 +109,12 @@ void main() {
 ################################
 # Skybox shader                #
 ################################
-skyFragmentCode = """#version 330 core
+skyFragmentCode = """#version 330 core""" + cameraBlockCode + """
 out vec4 FragColor;
 
 // Vertex Shader Output
 in vec3 FragPos;
 
-// Uniforms
-uniform float sunHeight;
-
 void main()
 {
     // Declare result
@@ -116,7 +161,7 @@ void main()
 #############################
 # Block Shader              #
 #############################
-blockFragmentCode = """#version 330 core
+blockFragmentCode = """#version 330 core""" + cameraBlockCode + """
 out vec4 FragColor;
 
 in vec3 FragPos;
@@ -124,15 +169,20 @@ in vec2 TexCoords;
 in float Brightness;
 
 uniform sampler2D uTextureAtlas;
-uniform float uSunHeight;
 
 uniform float uMinLighting = 0.0;
 
+// TexCoords are tile * TILE_SPAN + position in the tile, so that merged quads repeat their tile (see chunkVertexCode)
+const float TILE_SPAN = 512.0;
+const vec2 ATLAS_SIZE = vec2(4.0, 4.0);
+
 void main()
 {
-    vec4 result = texture(uTextureAtlas, TexCoords);
+    vec2 tile = floor(TexCoords / TILE_SPAN);
+    vec2 local = fract(TexCoords - tile * TILE_SPAN);
+    vec4 result = texture(uTextureAtlas, (tile + local) / ATLAS_SIZE);
     result.xyz *= Brightness;
-    result.xyz *= (1.0 - (uSunHeight * 3 / 4)) * (1.0 - uMinLighting) + uMinLighting;
+    result.xyz *= (1.0 - (sunHeight * 3 / 4)) * (1.0 - uMinLighting) + uMinLighting;
     // Return
     FragColor = result;
 }
@@ -161,7 +211,10 @@ void main()
 reticleFragmentCode = """#version 330 core
 out vec4 FragColor;
 
+// Also used for the telemetry overlay (see hud.py)
+uniform vec4 uColor = vec4(0.8, 0.8, 0.8, 1.0);
+
 void main() {
-    FragColor = vec4(0.8, 0.8, 0.8, 1.0);
+    FragColor = uColor;
 }
 """
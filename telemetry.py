@@ -0,0 +1,109 @@
+# Telemetry
+# Per frame numbers (frame time, update and draw time, simulation ticks, chunks drawn and culled, vertices, GL calls,
+# queue sizes, chunk loads, visible faces and the quads they were meshed into, GPU memory allocated for the chunk meshes
+# and how much of it they use) for finding hitches and what caused them. The last TELEMETRY_FRAMES frames are kept for
+# the overlay (see hud.py), and every frame can also be written to a log file:
+#
+#     FALAFEL_TELEMETRY=frames.csv python main.py      one CSV row per frame
+#     FALAFEL_TELEMETRY=frames.jsonl python main.py    one JSON object per line (any other extension)
+#
+# Frames that go over FRAME_BUDGET_MS are counted as hitches.
+import csv
+import json
+import os
+import time
+from collections import deque
+
+from settings import TELEMETRY_FRAMES, FRAME_BUDGET_MS
+
+TELEMETRY_ENV_VAR = "FALAFEL_TELEMETRY"
+LOG_FLUSH_FRAMES = 60 # Logs get flushed at least this often so a crash doesn't lose the frames leading up to it
+
+# The columns of the log, in order
+FRAME_FIELDS = ("time", "frameMs", "updateMs", "drawMs", "ticks",
+                "chunksDrawn", "chunksCulled", "vertices", "drawCalls", "glCalls",
+                "blockQueue", "workerQueue", "chunksLoaded", "chunksUnloaded",
+                "faces", "quads", "meshAllocatedBytes", "meshUsedBytes")
+
+# Things that get counted where they happen during a frame (the meshes, shaders and world add to these)
+class FrameCounters:
+    __slots__ = ("drawCalls", "vertices", "glCalls", "chunksLoaded", "chunksUnloaded")
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.drawCalls = 0
+        self.vertices = 0
+        self.glCalls = 0 # Only the calls made by ShaderProgram and the meshes
+        self.chunksLoaded = 0
+        self.chunksUnloaded = 0
+
+    def toDict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+frameCounters = FrameCounters()
+
+class Telemetry:
+    def __init__(self, logPath = None, maxFrames = TELEMETRY_FRAMES, budgetMs = FRAME_BUDGET_MS):
+        self.frames = deque(maxlen=maxFrames) # Dicts with the FRAME_FIELDS of the last frames, oldest first
+        self.budgetMs = budgetMs
+        self.numFrames = 0 # Since the start
+        self.hitches = 0 # Frames over budget since the start
+
+        self.startTime = time.perf_counter()
+        self.frameStart = None
+        self.frame = None # The frame that's going on
+
+        # Log
+        self.logFile = None
+        self.logWriter = None
+        if logPath:
+            self.logFile = open(logPath, "w", newline="")
+            if os.path.splitext(logPath)[1].lower() == ".csv":
+                self.logWriter = csv.DictWriter(self.logFile, FRAME_FIELDS)
+                self.logWriter.writeheader()
+
+    # Finish the last frame and start a new one, returns the new frame's dict so the caller can fill in its timings and
+    # sizes (everything that isn't filled in stays 0)
+    def beginFrame(self):
+        now = time.perf_counter()
+        if self.frame is not None:
+            self.frame["frameMs"] = (now - self.frameStart) * 1000
+            self.frame.update(frameCounters.toDict())
+            self.addFrame(self.frame)
+        frameCounters.reset()
+        self.frameStart = now
+        self.frame = dict.fromkeys(FRAME_FIELDS, 0)
+        self.frame["time"] = now - self.startTime
+        return self.frame
+
+    def addFrame(self, frame):
+        self.frames.append(frame)
+        self.numFrames += 1
+        if frame["frameMs"] > self.budgetMs:
+            self.hitches += 1
+        if self.logFile is not None:
+            if self.logWriter is not None:
+                self.logWriter.writerow(frame)
+            else:
+                self.logFile.write(json.dumps(frame) + "\n")
+            # Flush right away on hitches, those are the frames that matter if the game goes down
+            if frame["frameMs"] > self.budgetMs or self.numFrames % LOG_FLUSH_FRAMES == 0:
+                self.logFile.flush()
+
+    # Get the mean of each field over the last frames (None before the first frame has finished)
+    def getAverages(self, numFrames = None):
+        frames = list(self.frames)[-numFrames:] if numFrames else list(self.frames)
+        if not frames:
+            return None
+        return {field: sum(frame[field] for frame in frames) / len(frames) for field in FRAME_FIELDS}
+
+    def close(self):
+        if self.logFile is not None:
+            self.logFile.close()
+            self.logFile = None
+
+# Log to the file in FALAFEL_TELEMETRY if it's set
+def createTelemetry():
+    return Telemetry(os.environ.get(TELEMETRY_ENV_VAR) or None)
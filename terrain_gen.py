@@ -2,40 +2,334 @@
 # Noise
 from opensimplex import OpenSimplex
 import random
+from functools import lru_cache
+
+import numpy as np
 
 #from profiling import *
 
 # Terrain generation settings
-from settings import MAX_HEIGHT
+from settings import MAX_HEIGHT, NOISE_CONTEXT_CACHE_SIZE
+
+# OpenSimplex constants (the same ones the opensimplex package uses)
+STRETCH_CONSTANT_2D = -0.211324865405187
+SQUISH_CONSTANT_2D = 0.366025403784439
+STRETCH_CONSTANT_3D = -1.0 / 6
+SQUISH_CONSTANT_3D = 1.0 / 3
+NORM_CONSTANT_2D = 47
+NORM_CONSTANT_3D = 103
+
+GRADIENTS_2D = np.array((
+     5,  2,    2,  5,
+    -5,  2,   -2,  5,
+     5, -2,    2, -5,
+    -5, -2,   -2, -5,
+))
+GRADIENTS_3D = np.array((
+    -11,  4,  4,     -4,  11,  4,    -4,  4,  11,
+     11,  4,  4,      4,  11,  4,     4,  4,  11,
+    -11, -4,  4,     -4, -11,  4,    -4, -4,  11,
+     11, -4,  4,      4, -11,  4,     4, -4,  11,
+    -11,  4, -4,     -4,  11, -4,    -4,  4, -11,
+     11,  4, -4,      4,  11, -4,     4,  4, -11,
+    -11, -4, -4,     -4, -11, -4,    -4, -4, -11,
+     11, -4, -4,      4, -11, -4,     4, -4, -11,
+))
+
+# Wrap a python int to a signed 64 bit int
+def overflow64(x):
+    x &= 0xFFFFFFFFFFFFFFFF
+    return x - (1 << 64) if x >= (1 << 63) else x
+
+# Generate the same permutation tables as OpenSimplex(seed)
+def genPermutation(seed):
+    perm = np.zeros(256, dtype=np.int64)
+    permGradIndex3D = np.zeros(256, dtype=np.int64)
+    source = list(range(256))
+    for _ in range(3):
+        seed = overflow64(seed * 6364136223846793005 + 1442695040888963407)
+    for i in range(255, -1, -1):
+        seed = overflow64(seed * 6364136223846793005 + 1442695040888963407)
+        r = int((seed + 31) % (i + 1))
+        perm[i] = source[r]
+        permGradIndex3D[i] = (perm[i] % (len(GRADIENTS_3D) // 3)) * 3
+        source[r] = source[i]
+    return perm, permGradIndex3D
+
+# Pick between per axis offsets with a boolean mask
+def selectOffset(mask, a, b):
+    return [np.where(mask, a[i], b[i]) for i in range(len(a))]
+
+# OpenSimplex noise evaluated over whole numpy arrays of coordinates at once
+# Every point gets exactly the lattice vertices that OpenSimplex.noise2d/noise3d would use,
+# so the results match the scalar functions (down to floating point summation order)
+class OpenSimplexArray:
+    def __init__(self, seed):
+        self.perm, self.permGradIndex3D = genPermutation(seed)
+
+    # Add the contribution of the lattice vertex at (base + offset) to value wherever mask is true
+    def contribute2d(self, value, mask, xsb, ysb, dx0, dy0, ox, oy):
+        s = (ox + oy) * SQUISH_CONSTANT_2D
+        dx = dx0 - ox - s
+        dy = dy0 - oy - s
+        attn = 2 - dx * dx - dy * dy
+        perm = self.perm
+        index = perm[(perm[(xsb + ox) & 0xFF] + ysb + oy) & 0xFF] & 0x0E
+        attn = np.where(mask & (attn > 0), attn, 0.0)
+        attn *= attn
+        value += attn * attn * (GRADIENTS_2D[index] * dx + GRADIENTS_2D[index + 1] * dy)
+
+    def contribute3d(self, value, mask, xsb, ysb, zsb, dx0, dy0, dz0, ox, oy, oz):
+        s = (ox + oy + oz) * SQUISH_CONSTANT_3D
+        dx = dx0 - ox - s
+        dy = dy0 - oy - s
+        dz = dz0 - oz - s
+        attn = 2 - dx * dx - dy * dy - dz * dz
+        perm = self.perm
+        index = self.permGradIndex3D[(perm[(perm[(xsb + ox) & 0xFF] + ysb + oy) & 0xFF] + zsb + oz) & 0xFF]
+        attn = np.where(mask & (attn > 0), attn, 0.0)
+        attn *= attn
+        value += attn * attn * (GRADIENTS_3D[index] * dx + GRADIENTS_3D[index + 1] * dy + GRADIENTS_3D[index + 2] * dz)
+
+    def noise2d(self, x, y):
+        x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64)
+        # Place input coordinates onto grid
+        stretchOffset = (x + y) * STRETCH_CONSTANT_2D
+        xs = x + stretchOffset
+        ys = y + stretchOffset
+        xsb = np.floor(xs).astype(np.int64)
+        ysb = np.floor(ys).astype(np.int64)
+        squishOffset = (xsb + ysb) * SQUISH_CONSTANT_2D
+        xins = xs - xsb
+        yins = ys - ysb
+        inSum = xins + yins
+        dx0 = x - (xsb + squishOffset)
+        dy0 = y - (ysb + squishOffset)
+
+        value = np.zeros(x.shape)
+        always = np.ones(x.shape, dtype=bool)
+        lower = inSum <= 1 # Inside the triangle at (0,0) instead of the one at (1,1)
+        # The two vertices shared by both triangles
+        self.contribute2d(value, always, xsb, ysb, dx0, dy0, 1, 0)
+        self.contribute2d(value, always, xsb, ysb, dx0, dy0, 0, 1)
+        # The third vertex of the triangle
+        self.contribute2d(value, lower, xsb, ysb, dx0, dy0, 0, 0)
+        self.contribute2d(value, ~lower, xsb, ysb, dx0, dy0, 1, 1)
+        # The extra vertex
+        zins = np.where(lower, 1 - inSum, 2 - inSum)
+        xGreater = xins > yins
+        lowerNear = (zins > xins) | (zins > yins) # (0,0) is one of the closest two triangular vertices
+        upperNear = (zins < xins) | (zins < yins) # (1,1) is one of the closest two triangular vertices
+        extX = np.where(lower,
+                        np.where(lowerNear, np.where(xGreater, 1, -1), 1),
+                        np.where(upperNear, np.where(xGreater, 2, 0), 0))
+        extY = np.where(lower,
+                        np.where(lowerNear, np.where(xGreater, -1, 1), 1),
+                        np.where(upperNear, np.where(xGreater, 0, 2), 0))
+        self.contribute2d(value, always, xsb, ysb, dx0, dy0, extX, extY)
+
+        return value / NORM_CONSTANT_2D
+
+    def noise3d(self, x, y, z):
+        x = np.asarray(x, dtype=np.float64); y = np.asarray(y, dtype=np.float64); z = np.asarray(z, dtype=np.float64)
+        # Place input coordinates on simplectic honeycomb
+        stretchOffset = (x + y + z) * STRETCH_CONSTANT_3D
+        xs = x + stretchOffset
+        ys = y + stretchOffset
+        zs = z + stretchOffset
+        xsb = np.floor(xs).astype(np.int64)
+        ysb = np.floor(ys).astype(np.int64)
+        zsb = np.floor(zs).astype(np.int64)
+        squishOffset = (xsb + ysb + zsb) * SQUISH_CONSTANT_3D
+        xins = xs - xsb
+        yins = ys - ysb
+        zins = zs - zsb
+        inSum = xins + yins + zins
+        dx0 = x - (xsb + squishOffset)
+        dy0 = y - (ysb + squishOffset)
+        dz0 = z - (zsb + squishOffset)
+
+        # Which of the three regions of the super-cell each point is in
+        lowTet = inSum <= 1 # Tetrahedron at (0,0,0)
+        highTet = ~lowTet & (inSum >= 2) # Tetrahedron at (1,1,1)
+        octa = ~lowTet & ~highTet # Octahedron in between
+
+        ext0, ext1 = self.extraVertices3d(xins, yins, zins, inSum, lowTet, highTet)
+
+        value = np.zeros(x.shape)
+        args = (xsb, ysb, zsb, dx0, dy0, dz0)
+        # The corners of the super-cell that belong to each region
+        self.contribute3d(value, lowTet, *args, 0, 0, 0)
+        for offset in ((1, 0, 0), (0, 1, 0), (0, 0, 1)):
+            self.contribute3d(value, lowTet | octa, *args, *offset)
+        for offset in ((1, 1, 0), (1, 0, 1), (0, 1, 1)):
+            self.contribute3d(value, highTet | octa, *args, *offset)
+        self.contribute3d(value, highTet, *args, 1, 1, 1)
+        # The two extra vertices
+        always = np.ones(x.shape, dtype=bool)
+        self.contribute3d(value, always, *args, *ext0)
+        self.contribute3d(value, always, *args, *ext1)
+
+        return value / NORM_CONSTANT_3D
+
+    # Work out the two lattice vertices outside of the containing simplex that may contribute (mirrors OpenSimplex.noise3d)
+    def extraVertices3d(self, xins, yins, zins, inSum, lowTet, highTet):
+        bits = lambda c: [(c & 0x01) != 0, (c & 0x02) != 0, (c & 0x04) != 0]
+
+        # Tetrahedron at (0,0,0): find the closest two of (1,0,0), (0,1,0), (0,0,1)
+        aPoint = np.full(xins.shape, 0x01); aScore = xins.copy()
+        bPoint = np.full(xins.shape, 0x02); bScore = yins.copy()
+        swapB = (aScore >= bScore) & (zins > bScore)
+        swapA = ~swapB & (aScore < bScore) & (zins > aScore)
+        bPoint = np.where(swapB, 0x04, bPoint); bScore = np.where(swapB, zins, bScore)
+        aPoint = np.where(swapA, 0x04, aPoint); aScore = np.where(swapA, zins, aScore)
+        wins = 1 - inSum
+        originNear = (wins > aScore) | (wins > bScore)
+        c = np.where(originNear, np.where(bScore > aScore, bPoint, aPoint), aPoint | bPoint)
+        cx, cy, cz = bits(c)
+        nearLow0 = [np.where(cx, 1, -1), np.where(cy, 1, np.where(cx, -1, 0)), np.where(cz, 1, 0)]
+        nearLow1 = [np.where(cx, 1, 0), np.where(cy, 1, np.where(cx, 0, -1)), np.where(cz, 1, -1)]
+        farLow0 = [np.where(cx, 1, 0), np.where(cy, 1, 0), np.where(cz, 1, 0)]
+        farLow1 = [np.where(cx, 1, -1), np.where(cy, 1, -1), np.where(cz, 1, -1)]
+        low0 = selectOffset(originNear, nearLow0, farLow0)
+        low1 = selectOffset(originNear, nearLow1, farLow1)
+
+        # Tetrahedron at (1,1,1): find the closest two of (1,1,0), (1,0,1), (0,1,1)
+        aPoint = np.full(xins.shape, 0x06); aScore = xins.copy()
+        bPoint = np.full(xins.shape, 0x05); bScore = yins.copy()
+        swapB = (aScore <= bScore) & (zins < bScore)
+        swapA = ~swapB & (aScore > bScore) & (zins < aScore)
+        bPoint = np.where(swapB, 0x03, bPoint); bScore = np.where(swapB, zins, bScore)
+        aPoint = np.where(swapA, 0x03, aPoint); aScore = np.where(swapA, zins, aScore)
+        wins = 3 - inSum
+        cornerNear = (wins < aScore) | (wins < bScore)
+        c = np.where(cornerNear, np.where(bScore < aScore, bPoint, aPoint), aPoint & bPoint)
+        cx, cy, cz = bits(c)
+        nearHigh0 = [np.where(cx, 2, 0), np.where(cy, np.where(cx, 1, 2), 0), np.where(cz, 1, 0)]
+        nearHigh1 = [np.where(cx, 1, 0), np.where(cy, np.where(cx, 2, 1), 0), np.where(cz, 2, 0)]
+        farHigh0 = [np.where(cx, 1, 0), np.where(cy, 1, 0), np.where(cz, 1, 0)]
+        farHigh1 = [np.where(cx, 2, 0), np.where(cy, 2, 0), np.where(cz, 2, 0)]
+        high0 = selectOffset(cornerNear, nearHigh0, farHigh0)
+        high1 = selectOffset(cornerNear, nearHigh1, farHigh1)
+
+        # Octahedron: decide between (0,0,1) and (1,1,0), then (0,1,0) and (1,0,1)
+        p1 = xins + yins
+        aFar = p1 > 1
+        aScore = np.where(aFar, p1 - 1, 1 - p1); aPoint = np.where(aFar, 0x03, 0x04)
+        p2 = xins + zins
+        bFar = p2 > 1
+        bScore = np.where(bFar, p2 - 1, 1 - p2); bPoint = np.where(bFar, 0x05, 0x02)
+        # The closest of (1,0,0) and (0,1,1) replaces the furthest of those two if it's closer
+        p3 = yins + zins
+        p3Far = p3 > 1
+        score = np.where(p3Far, p3 - 1, 1 - p3)
+        replaceA = (aScore <= bScore) & (aScore < score)
+        replaceB = ~replaceA & (aScore > bScore) & (bScore < score)
+        aPoint = np.where(replaceA, np.where(p3Far, 0x06, 0x01), aPoint); aFar = np.where(replaceA, p3Far, aFar)
+        bPoint = np.where(replaceB, np.where(p3Far, 0x06, 0x01), bPoint); bFar = np.where(replaceB, p3Far, bFar)
+
+        # A permutation of (1,1,-1), with -1 on the first axis that isn't in c
+        def oneOneMinusOne(c):
+            cx, cy, _ = bits(c)
+            return [np.where(~cx, -1, 1), np.where(cx & ~cy, -1, 1), np.where(cx & cy, -1, 1)]
+        # A permutation of (2,0,0), with 2 on the first axis that is in c
+        def twoZeroZero(c):
+            cx, cy, _ = bits(c)
+            return [np.where(cx, 2, 0), np.where(~cx & cy, 2, 0), np.where(~cx & ~cy, 2, 0)]
+
+        sameSide = aFar == bFar
+        zeros = np.zeros(xins.shape, dtype=np.int64)
+        # Both closest points on the same side: the corner of that side plus one based on the shared/omitted axis
+        sameFar0 = [zeros + 1] * 3
+        sameFar1 = twoZeroZero(aPoint & bPoint)
+        sameNear0 = [zeros] * 3
+        sameNear1 = oneOneMinusOne(aPoint | bPoint)
+        same0 = selectOffset(aFar, sameFar0, sameNear0)
+        same1 = selectOffset(aFar, sameFar1, sameNear1)
+        # One point on each side
+        c1 = np.where(aFar, aPoint, bPoint)
+        c2 = np.where(aFar, bPoint, aPoint)
+        split0 = oneOneMinusOne(c1)
+        split1 = twoZeroZero(c2)
+        octa0 = selectOffset(sameSide, same0, split0)
+        octa1 = selectOffset(sameSide, same1, split1)
+
+        ext0 = selectOffset(lowTet, low0, selectOffset(highTet, high0, octa0))
+        ext1 = selectOffset(lowTet, low1, selectOffset(highTet, high1, octa1))
+        return ext0, ext1
+
+# Noise generators for one seed, built once and shared by every sample
+# Nothing here touches the global random state, so contexts can be used from several threads at once
+class NoiseContext:
+    def __init__(self, seed):
+        self.seed = seed
+        # The seeds of the fractal layers (the second layer is also used for biomes)
+        rng = random.Random(seed)
+        layerSeeds = [seed] + [rng.randint(0, 1000000) for _ in range(3)]
+        # Scalar generators for single samples and array generators for whole chunks
+        self.generators = [OpenSimplex(seed=s) for s in layerSeeds]
+        self.arrayGenerators = [OpenSimplexArray(s) for s in layerSeeds]
+
+    # Noise combining (works for both floats and numpy arrays)
+    @staticmethod
+    def combineBiome(generators, x, y):
+        return (generators[1].noise2d(x / 1000, y / 1000) + 1) / 2 # Converting it to positive space
+
+    @staticmethod
+    def combineFractal(generators, x, y):
+        _x, _y = x / 10, y / 10
+        # Get noise layers
+        noise, noise2, noise3, noise4 = [n.noise2d(_x, _y) for n in generators]
+        # Combine them and return
+        return noise + (noise2 / 2) + (noise3 / 4) + (noise4 / 8)
+
+    # Single samples
+    def biome(self, x, y):
+        return self.combineBiome(self.generators, x, y)
+
+    def fractal(self, x, y):
+        return self.combineFractal(self.generators, x, y)
+
+    def height(self, x, y):
+        return getHeightFromNoise(self.fractal(x, y), self.biome(x, y))
+
+    def cave(self, x, y, z):
+        return self.generators[0].noise3d(x / 10, y / 10, z / 10)
+
+    # Samples over numpy arrays of block coordinates
+    def biomeArray(self, x, y):
+        return self.combineBiome(self.arrayGenerators, x, y)
+
+    def fractalArray(self, x, y):
+        return self.combineFractal(self.arrayGenerators, x, y)
+
+    def heightArray(self, x, y):
+        return getHeightFromNoiseArray(self.fractalArray(x, y), self.biomeArray(x, y))
+
+    def caveArray(self, x, y, z):
+        return self.arrayGenerators[0].noise3d(x / 10, y / 10, z / 10)
+
+    # Get the height map of a width x width area of columns starting at block (x, y), indexed [x, y]
+    def heightMap(self, x, y, width):
+        _x, _y = np.meshgrid(np.arange(x, x + width), np.arange(y, y + width), indexing='ij')
+        return self.heightArray(_x, _y)
+
+# Get the noise context for a seed (the least recently used ones are dropped past NOISE_CONTEXT_CACHE_SIZE)
+@lru_cache(maxsize=NOISE_CONTEXT_CACHE_SIZE)
+def getNoiseContext(seed):
+    return NoiseContext(seed)
 
 # Biome noise
 def getBiomeNoise(x, y, seed):
-    _x, _y = x / 1000, y / 1000
-    random.seed(seed)
-    n = OpenSimplex(seed=random.randint(0, 1000000))
-    # Get noise layers
-    noise = (n.noise2d(_x, _y) + 1) / 2 # Converting it to positive space
-    # Combine them and return
-    return noise
+    return getNoiseContext(seed).biome(x, y)
 
 # Fractal noise
 def getFractalNoise(x, y, seed):
-    _x, _y = x / 10, y / 10
-    n = OpenSimplex(seed=seed)
-    # Get noise layers
-    noise = (n.noise2d(_x, _y)) # Converting it to positive space
-    random.seed(seed); n = OpenSimplex(seed=random.randint(0, 1000000))
-    noise2 = (n.noise2d(_x, _y))
-    n = OpenSimplex(seed=random.randint(0, 1000000))
-    noise3 = (n.noise2d(_x, _y))
-    n = OpenSimplex(seed=random.randint(0, 1000000))
-    noise4 = (n.noise2d(_x, _y))
-    # Combine them and return
-    return noise + (noise2 / 2) + (noise3 / 4) + (noise4 / 8)
+    return getNoiseContext(seed).fractal(x, y)
 
 # Cave noise
 def getCaveNoise(x, y, z, seed):
-    return OpenSimplex(seed=seed).noise3d(x / 10, y / 10, z / 10)
+    return getNoiseContext(seed).cave(x, y, z)
 
 # Get proper height data from a noise value
 def getHeightFromNoise(v: float, biomeValue: float):
@@ -58,3 +352,30 @@ def getHeightFromNoise(v: float, biomeValue: float):
     r = v * m
     r += MAX_HEIGHT
     return abs(int(round(r)))
+
+# Array versions of the noise functions above (take numpy arrays of block coordinates)
+def getBiomeNoiseArray(x, y, seed):
+    return getNoiseContext(seed).biomeArray(x, y)
+
+def getFractalNoiseArray(x, y, seed):
+    return getNoiseContext(seed).fractalArray(x, y)
+
+def getCaveNoiseArray(x, y, z, seed):
+    return getNoiseContext(seed).caveArray(x, y, z)
+
+# Height multipliers for each biome (same as getHeightFromNoise)
+def getHeightFromNoiseArray(v, biomeValue):
+    m = np.select([(0 < biomeValue) & (biomeValue < 0.5),
+                   (0.5 < biomeValue) & (biomeValue < 0.75),
+                   (0.75 < biomeValue) & (biomeValue < 0.8)],
+                  [(2 / 2) + (2 * (0.5 - 0)),
+                   (4 / 2) + (4 * (0.75 - 0.5)),
+                   (8 / 2) + (8 * (0.8 - 0.75))],
+                  (16 / 2) + (16 * (1.0 - 0.8)))
+    r = v * m
+    r += MAX_HEIGHT
+    return np.abs(np.round(r)).astype(np.int64)
+
+# Get the height map of a width x width area of columns starting at block (x, y), indexed [x, y]
+def getHeightMap(x, y, width, seed):
+    return getNoiseContext(seed).heightMap(x, y, width)
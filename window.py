@@ -2,9 +2,11 @@ from OpenGL.GL import *
 from glfw.GLFW import *
 import time
 
+from profiling import profiler, profile
+
 class Window:
     def __init__(self, width=800, height=600, caption="Game Window", contextVersionMajor=3, contextVersionMinor=3,
-                 resizable=True, vsync=True, samples=None):
+                 resizable=True, vsync=True, samples=None, ticksPerSecond=20, maxTicksPerFrame=5):
         # Initialize GLFW and set window hints
         glfwInit()
         glfwWindowHint(GLFW_CONTEXT_VERSION_MAJOR, contextVersionMajor)
@@ -56,9 +58,21 @@ class Window:
 
         # Setup loop functions
         self.loopFunctions = []
+        self.tickFunctions = []
+
+        # Fixed timestep (see gameLoop())
+        self.tickLength = 1 / ticksPerSecond
+        self.maxTicksPerFrame = maxTicksPerFrame
+        self.tickAccumulator = 0 # Time that hasn't been simulated yet
+        self.tickAlpha = 0 # How far the frame is between the last two ticks (0 to 1), for interpolating
+        self.frameTime = 0 # Length of the last frame
+        self.frameTicks = 0 # Ticks run this frame
+        self.tickTime = 0 # Time spent running them
+        self.droppedTime = 0 # Time that the simulation skipped because it couldn't catch up, since the start
 
         # Width and height
         self.width = width; self.height = height
+        self.caption = caption
 
     # Input functions
     def framebuffer_size_callback(self, window, width, height):
@@ -137,13 +151,13 @@ class Window:
 
     # Time functions
     def getTimeInterval(self):
+        t = time.perf_counter()
         if not self.firstTimeInterval:
-            t = time.perf_counter()
             r = t - self.elapsedTime
-            self.elapsedTime = t
         else:
             r = 0
             self.firstTimeInterval = False
+        self.elapsedTime = t
         return r
 
     # Render loop functions
@@ -153,16 +167,44 @@ class Window:
     def addLoop(self, function):
         self.loopFunctions.append(function)
 
+    # Functions that run once per tick, tickLength seconds of simulation each
+    def addTick(self, function):
+        self.tickFunctions.append(function)
+
+    # Run the ticks that the time since the last frame adds up to
+    @profile("Window.runTicks()")
+    def runTicks(self):
+        self.frameTime = self.getTimeInterval()
+        self.tickAccumulator += self.frameTime
+        tickStart = time.perf_counter()
+        self.frameTicks = 0
+        while self.tickAccumulator >= self.tickLength and self.frameTicks < self.maxTicksPerFrame:
+            for function in self.tickFunctions:
+                function()
+            self.tickAccumulator -= self.tickLength
+            self.frameTicks += 1
+        # Too far behind to catch up (a long hitch), drop the whole ticks that are left instead of running more and more
+        # of them every frame
+        if self.tickAccumulator >= self.tickLength:
+            dropped = self.tickAccumulator - self.tickAccumulator % self.tickLength
+            self.droppedTime += dropped
+            self.tickAccumulator -= dropped
+        self.tickTime = time.perf_counter() - tickStart
+        self.tickAlpha = self.tickAccumulator / self.tickLength
+
     def gameLoop(self):
         while not glfwWindowShouldClose(self.window):
             # Poll events
             glfwPollEvents()
-            # Run given functions
+            # Simulation runs at a fixed rate, as many ticks as the frame took
+            self.runTicks()
+            # Run given functions (rendering, interpolated by tickAlpha)
             for i in range(len(self.loopFunctions)):
                 self.loopFunctions[i]()
 
             # Swap buffers
             glfwSwapBuffers(self.window)
+            profiler.endFrame()
 
         # Terminate after exiting loop
         glfwTerminate()
@@ -1,7 +1,21 @@
 # Imports
+# Default
+from concurrent.futures import ProcessPoolExecutor, Future
+from collections import OrderedDict
+import json
+import multiprocessing
+import os
+import random
 # Project Files
 from chunk import *
 from profiling import *
+from telemetry import frameCounters
+from camera import boxInFrustum
+from region import chunkStores
+
+from settings import CHUNK_WORKERS, CHUNK_UPLOADS_PER_FRAME, RENDER_DISTANCE, CHUNK_UNLOAD_MARGIN, CHUNK_CACHE_BYTES
+from settings import CHUNK_BORDER_REMESHES_PER_FRAME
+from settings import SAVE_DIRECTORY, LEVEL_FILE, CHUNK_STORAGE
 
 # Chunk generation distance
 CHUNK_DIST = 2  # Because it's a nice number
@@ -18,51 +32,279 @@ def getRelativeChunkPos(pos):
     return tuple(r)
 
 
+# Least recently used cache of unloaded chunks' data (in the format genChunkData() returns), limited to a number of bytes
+class ChunkCache:
+    def __init__(self, maxBytes):
+        self.maxBytes = maxBytes
+        self.entries = OrderedDict() # Chunk position -> data, oldest first
+        self.size = 0 # In bytes
+
+    @staticmethod
+    def sizeOf(data):
+        return sum(array.nbytes for array in data[:3] if array is not None)
+
+    def put(self, key, data):
+        self.pop(key)
+        size = self.sizeOf(data)
+        if size > self.maxBytes:
+            return
+        self.entries[key] = data
+        self.size += size
+        # Evict the least recently unloaded chunks
+        while self.size > self.maxBytes:
+            self.size -= self.sizeOf(self.entries.popitem(last=False)[1])
+
+    # Take a chunk's data out of the cache (None if it isn't there)
+    def pop(self, key):
+        data = self.entries.pop(key, None)
+        if data is not None:
+            self.size -= self.sizeOf(data)
+        return data
+
+
+# Get the seed of the saved world so that its saved chunks get opened again, a new world gets a random seed that's saved
+# for next time
+def getWorldSeed(saveDirectory = SAVE_DIRECTORY):
+    path = os.path.join(saveDirectory, LEVEL_FILE)
+    if os.path.exists(path):
+        with open(path) as file:
+            return json.load(file)["seed"]
+    seed = random.randint(0, 1000000)
+    os.makedirs(saveDirectory, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump({"seed": seed}, file)
+    return seed
+
 # World Class Thing
 class World:
-    # Variables
-    # Chunks
-    chunks = dict()
-
     # Initializer
-    def __init__(self, seed):
-        t = Timer("World.__init__(seed)")
+    @profile("World.__init__(seed)")
+    def __init__(self, seed, workers = CHUNK_WORKERS, uploadsPerFrame = CHUNK_UPLOADS_PER_FRAME, renderDistance = RENDER_DISTANCE,
+                 cacheBytes = CHUNK_CACHE_BYTES, saveDirectory = SAVE_DIRECTORY, storage = CHUNK_STORAGE,
+                 borderRemeshesPerFrame = CHUNK_BORDER_REMESHES_PER_FRAME):
+        # Chunks
+        self.chunks = dict()
+        # Recently unloaded chunks (coming back to them only needs an upload)
+        self.cache = ChunkCache(cacheBytes)
 
         # Setup the fractal noise for the heightmap
         self.seed = seed
+        # Saved chunks (generated chunks get saved too, so that coming back to them is a disk read instead of a noise pass)
+        self.store = chunkStores[storage](os.path.join(saveDirectory, str(seed)))
         # load center chunk
         #self.loadChunk(0, 0)
         self.toLoad = list()
 
-    # Load chunk
-    def loadChunk(self, chunkX, chunkY):
-        t = Timer("World.loadChunk(int, int)")
+        # Chunk generation and meshing happens in worker processes, the main thread only uploads the results
+        # (spawn instead of fork so the workers don't inherit the window and OpenGL context)
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+        self.pending = dict() # Chunk position -> Future of genChunkData() (or of the cached data for restored chunks)
+        self.meshedWith = dict() # Chunk position -> positions of the neighbors that were loaded when it was sent off
+        self.uploadsPerFrame = uploadsPerFrame
+        # Chunks whose borders need re-meshing (in the order they were added), at most borderRemeshesPerFrame of them get
+        # done each frame
+        self.borderQueue = OrderedDict()
+        self.borderRemeshesPerFrame = borderRemeshesPerFrame
 
+        # Culling
+        self.renderDistance = renderDistance
+        self.chunksDrawn = 0; self.chunksCulled = 0 # During the last Draw()
+
+    # Load chunk (synchronously, on the calling thread)
+    @profile("World.loadChunk(int, int)")
+    def loadChunk(self, chunkX, chunkY):
         # Only load it if the chunk doesn't already exist
         if not (chunkX, chunkY) in self.chunks.keys():
-            # Load the chunk
-            self.chunks[(chunkX, chunkY)] = Chunk(chunkX, chunkY, self.seed)
+            if self.restoreChunk((chunkX, chunkY)):
+                return
+            # Load the chunk (from the save if it's there)
+            chunk = Chunk(chunkX, chunkY, self.seed, self.store.load(chunkX, chunkY))
+            chunk.blocks = self.store.attach(chunkX, chunkY, chunk.blocks)
+            chunk.world = self
+            chunk.generateChunkMesh()
+            self.chunks[(chunkX, chunkY)] = chunk
+            frameCounters.chunksLoaded += 1
+            self.remeshBorders((chunkX, chunkY), self.getNeighbors((chunkX, chunkY)).keys())
+
+    # Queue a chunk to be generated by the worker processes
+    def requestChunk(self, chunkX, chunkY):
+        if (chunkX, chunkY) not in self.chunks.keys() and (chunkX, chunkY) not in self.pending.keys():
+            # Cached chunks are ready right away, but they still wait for an upload slot like the workers' results
+            data = self.cache.pop((chunkX, chunkY))
+            if data is not None:
+                self.pending[(chunkX, chunkY)] = Future()
+                self.pending[(chunkX, chunkY)].set_result(data)
+                self.meshedWith[(chunkX, chunkY)] = set() # Its neighbors might have changed since it was unloaded
+                return
+            # Saved chunks only need meshing (reading them is quick enough for the main thread)
+            blocks = self.store.load(chunkX, chunkY)
+            # The workers get the blocks of the loaded neighbors so that the border faces come out right
+            neighbors = {neighborKey: np.asarray(chunk.blocks) for neighborKey, chunk in self.getNeighbors((chunkX, chunkY)).items()}
+            self.pending[(chunkX, chunkY)] = self.executor.submit(genChunkData, chunkX, chunkY, self.seed, blocks=blocks, neighbors=neighbors)
+            self.meshedWith[(chunkX, chunkY)] = set(neighbors)
+
+    # Create a chunk from the data of genChunkData(), meshedWith has the positions of the neighbors its mesh took into account
+    def addChunk(self, key, data, meshedWith = ()):
+        blocks, vertices, meshKeys, faceCount = data
+        chunk = Chunk(*key, self.seed, self.store.attach(*key, blocks))
+        chunk.world = self
+        chunk.uploadMesh(vertices, meshKeys, faceCount)
+        self.chunks[key] = chunk
+        frameCounters.chunksLoaded += 1
+        self.remeshBorders(key, meshedWith)
+
+    # Bring a chunk back from the cache, returns whether it was there
+    def restoreChunk(self, key):
+        data = self.cache.pop(key)
+        if data is not None:
+            self.addChunk(key, data) # Its neighbors might have changed since it was unloaded
+        return data is not None
+
+    # Get the loaded chunks around a chunk position (by their positions)
+    def getNeighbors(self, key):
+        neighbors = ((key[0] + dx, key[1] + dz) for dx in (-1, 0, 1) for dz in (-1, 0, 1) if dx or dz)
+        return {neighborKey: self.chunks[neighborKey] for neighborKey in neighbors if neighborKey in self.chunks}
+
+    # Queue the meshes along the borders between a chunk that was just added and its loaded neighbors for fixing
+    # (until they're fixed the neighbors only have extra faces against the new chunk's blocks, which hide them)
+    def remeshBorders(self, key, meshedWith):
+        neighbors = self.getNeighbors(key)
+        for neighborKey in neighbors:
+            self.borderQueue[neighborKey] = None
+        # The new chunk's border only needs fixing if it was meshed without some of these neighbors
+        if not set(neighbors) <= set(meshedWith):
+            self.borderQueue[key] = None
+
+    # Fix the borders of the chunks that have been queued the longest (at most borderRemeshesPerFrame of them)
+    @profile("World.remeshQueuedBorders()")
+    def remeshQueuedBorders(self):
+        for _ in range(min(self.borderRemeshesPerFrame, len(self.borderQueue))):
+            key = self.borderQueue.popitem(last=False)[0]
+            self.chunks[key].remeshBorder()
+
+    # Write a chunk's blocks to the save (in the background) if they changed
+    def saveChunk(self, key, chunk):
+        if chunk.dirty:
+            self.store.saveAsync(*key, chunk.blocks)
+            chunk.dirty = False
+
+    # Free a chunk's GPU memory and keep its data in the cache
+    def unloadChunk(self, key):
+        chunk = self.chunks.pop(key)
+        self.borderQueue.pop(key, None)
+        # The neighbors culled their border faces against this chunk's blocks, those faces are holes now (so they go first)
+        for neighborKey in self.getNeighbors(key):
+            self.borderQueue[neighborKey] = None
+            self.borderQueue.move_to_end(neighborKey, last=False)
+        self.saveChunk(key, chunk)
+        data = chunk.unload()
+        frameCounters.chunksUnloaded += 1
+        if data[1] is not None:
+            self.cache.put(key, data)
+
+    # Upload the chunks that the workers have finished (at most uploadsPerFrame of them)
+    @profile("World.uploadFinishedChunks()")
+    def uploadFinishedChunks(self):
+        finished = [key for key, future in self.pending.items() if future.done()][:self.uploadsPerFrame]
+        for key in finished:
+            self.addChunk(key, self.pending.pop(key).result(), self.meshedWith.pop(key))
+            # Chunks that weren't loaded from the save were generated
+            self.chunks[key].dirty = not self.store.has(*key)
 
     # Chunk updating
+    @profile("World.updateChunks(vec3)")
     def updateChunks(self, playerPos):
-        t = Timer("World.updateChunks(vec3)")
-
         # Get a list of the chunks that need to be loaded
-        cRange = range(-CHUNK_DIST // 2, CHUNK_DIST // 2)
+        cRange = range(-CHUNK_DIST, CHUNK_DIST + 1)
         pChunkPos = toChunkPos(playerPos)
-        # We already have index checking in the load function, so we don't need to exclude loaded chunks here
+        pChunkPos = (int(pChunkPos[0]), int(pChunkPos[1]))
         self.toLoad = [(x + pChunkPos[0], z + pChunkPos[1])
                        for x in cRange for z in cRange
-                       if ((x, z) not in self.chunks.keys())]
+                       if ((x + pChunkPos[0], z + pChunkPos[1]) not in self.chunks.keys())]
         # Start working on loading them
-        if len(self.toLoad) > 0:
-            print("%s Chunks left to load!" % str(len(self.toLoad)))
-            self.loadChunk(*self.toLoad[0])
+        for chunkPos in self.toLoad:
+            self.requestChunk(*chunkPos)
+        self.uploadFinishedChunks()
+        self.remeshQueuedBorders()
 
-    # Draw
-    def Draw(self):
-        t = Timer("World.Draw()")
+        # Unload chunks (and drop requests) that are far enough away, the margin keeps chunks at the edge of the load
+        # distance from being loaded and unloaded over and over when the player walks back and forth
+        isFar = lambda key: max(abs(key[0] - pChunkPos[0]), abs(key[1] - pChunkPos[1])) > CHUNK_DIST + CHUNK_UNLOAD_MARGIN
+        for key in [key for key in self.chunks.keys() if isFar(key)]:
+            self.unloadChunk(key)
+        for key in [key for key in self.pending.keys() if isFar(key)]:
+            self.pending.pop(key).cancel()
+            del self.meshedWith[key]
+
+    # Process the block queues of every chunk
+    def updateBlocks(self, dt):
+        for chunk in self.chunks.values():
+            chunk.updateChunk(dt)
+
+    # Get the chunk that a world space position is in (None if it isn't loaded)
+    def getChunkAt(self, pos):
+        return self.chunks.get((int(pos[0] // CHUNK_SIZE), int(pos[2] // CHUNK_SIZE)))
+
+    # Block access across chunks
+    # Get the block type id at any world space position (AIR where no chunk is loaded)
+    def getBlockID(self, pos):
+        chunk = self.getChunkAt(pos)
+        if chunk is None:
+            return AIR
+        localPos = chunk.toLocalPos(pos)
+        return AIR if localPos is None else int(chunk.blocks[localPos])
+
+    # Get a loaded chunk's block array (None if it isn't loaded)
+    def getChunkBlocks(self, chunkPos):
+        chunk = self.chunks.get(chunkPos)
+        return None if chunk is None else chunk.blocks
 
+    def checkBlock(self, pos):
+        chunk = self.getChunkAt(pos)
+        return chunk is not None and chunk.checkBlock(pos)
+
+    def addBlockToQueue(self, pos, blockID):
+        chunk = self.getChunkAt(pos)
+        if chunk is not None:
+            chunk.addBlockToQueue(pos, blockID)
+
+    # Get the number of block changes that are waiting in the chunks' queues
+    def getBlockQueueSize(self):
+        return sum(len(c.blockQueue) for c in self.chunks.values())
+
+    # Get the total number of visible block faces and the number of quads they were meshed into
+    def getMeshStats(self):
+        return sum(c.faceCount for c in self.chunks.values()), sum(c.quadCount for c in self.chunks.values())
+
+    # Get the GPU memory allocated for the chunk meshes and how much of it is used (in bytes)
+    def getMeshMemory(self):
+        used = sum(c.mesh.getUsedBytes() for c in self.chunks.values() if c.mesh is not None)
+        return chunkArena.getAllocatedBytes() + quadIndices.getAllocatedBytes(), used
+
+    # Stop the chunk workers and save the chunks that changed
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        for key, chunk in self.chunks.items():
+            self.saveChunk(key, chunk)
+        self.store.close()
+
+    # Test if a chunk is close enough and inside of the view frustum
+    def isChunkVisible(self, chunk, cameraPos, frustumPlanes):
+        # Horizontal distance from the camera to the closest point of the chunk
+        dx = max(chunk.boundsMin.x - cameraPos.x, 0, cameraPos.x - chunk.boundsMax.x)
+        dz = max(chunk.boundsMin.z - cameraPos.z, 0, cameraPos.z - chunk.boundsMax.z)
+        if dx * dx + dz * dz > self.renderDistance * self.renderDistance:
+            return False
+        return boxInFrustum(frustumPlanes, chunk.boundsMin, chunk.boundsMax)
+
+    # Draw
+    @profile("World.Draw(ShaderProgram, Camera, float)")
+    def Draw(self, shader, camera, aspectRatio):
         # Draw only the visible/fully loaded chunks
-        for key in self.chunks.keys():
-            self.chunks[key].Draw()
+        frustumPlanes = camera.getFrustumPlanes(aspectRatio)
+        meshes = [chunk.mesh for chunk in self.chunks.values()
+                  if chunk.mesh is not None and self.isChunkVisible(chunk, camera.pos, frustumPlanes)]
+        self.chunksDrawn = len(meshes)
+        self.chunksCulled = sum(chunk.mesh is not None for chunk in self.chunks.values()) - len(meshes)
+        # All of them in one draw call
+        chunkArena.Draw(shader, meshes)